@@ -13,6 +13,17 @@ from numpy.random import rand  # type: ignore
 import pandas as pd  # type: ignore
 from numba import jit  # type: ignore
 import matplotlib.pyplot as plt  # type: ignore
+from functions_history import STAGE_SNAPSHOT, INTERVAL_SNAPSHOT, SnapshotDifference
+from functions_profile import NO_PROFILE, ReadCycles
+from functions_profile import (
+    PROPOSAL_PHASE,
+    ENERGY_PHASE,
+    BINNING_PHASE,
+    FLATNESS_PHASE,
+)
+
+# Largest annealing factor of the energy walks (they never freeze completely)
+BMAX = 10.0
 
 """
 Classes
@@ -20,24 +31,132 @@ Classes
 
 
 class Lattice:
-    def __init__(self, size: int = 10):
+    """
+    Potts lattice on an arbitrary graph. The neighbors of site n are
+    neighbors[offsets[n]:offsets[n + 1]] (CSR adjacency) with the per-bond couplings
+    couplings[offsets[n]:offsets[n + 1]]. Every bond is stored in both directions.
+    """
+
+    def __init__(
+        self,
+        size: int = 10,
+        geometry: str = "square",
+        dilution: float = 0.0,
+    ):
         self.size = size
-        self.particles = size**2
-        self.grid = np.zeros((size, size))
+        self.geometry = geometry
+        self.shape, self.offsets, self.neighbors = BuildAdjacency(geometry, size)
+        self.spins = np.zeros(int(np.prod(self.shape)))
+        occupied = np.random.rand(len(self.spins)) >= dilution
+        if not np.all(occupied):
+            self.offsets, self.neighbors = DiluteAdjacency(
+                self.offsets, self.neighbors, occupied
+            )
+        self.sites = np.flatnonzero(occupied)
+        self.particles = len(self.sites)
+        self.couplings = np.ones(len(self.neighbors))
+
+    @property
+    def grid(self):
+        """
+        Spins in the shape of the lattice (a view on self.spins)
+        """
+        return self.spins.reshape(self.shape)
 
-    def Randomize(self):
-        with np.nditer(self.grid, op_flags=["readwrite"]) as it:
-            for x in it:
-                x[...] = random.choice([-1, 1])
+    @grid.setter
+    def grid(self, value):
+        self.spins = np.ascontiguousarray(value, dtype=np.float64).reshape(-1)
 
-    def GridEnergy(self, J):
-        return CalculateEnergy(self.grid, J)
+    def Bonds(self):
+        """
+        Returns the two end points (i < j) of every undirected bond
+        """
+        source = np.repeat(np.arange(len(self.spins)), np.diff(self.offsets))
+        forward = source < self.neighbors
+        return (source[forward], self.neighbors[forward])
+
+    def SetCouplings(self, J):
+        """
+        Sets the coupling constants, either one value for all bonds or one value per bond of Bonds()
+        """
+        source = np.repeat(np.arange(len(self.spins)), np.diff(self.offsets))
+        forward = source < self.neighbors
+        J = np.broadcast_to(np.asarray(J, dtype=np.float64), (np.sum(forward),))
+        keys = np.minimum(source, self.neighbors) * len(self.spins) + np.maximum(
+            source, self.neighbors
+        )
+        order = np.argsort(keys[forward])
+        bond = np.searchsorted(keys[forward][order], keys)
+        self.couplings = np.ascontiguousarray(J[order][bond])
+
+    def EnergyBounds(self):
+        """
+        Returns the lowest and the highest energy the couplings allow (every bond satisfied or broken)
+        """
+        LB = -np.sum(np.maximum(self.couplings, 0.0)) / 2.0
+        UB = np.sum(np.maximum(-self.couplings, 0.0)) / 2.0
+        return (float(LB), float(UB))
+
+    def EnergySpacing(self, q: int = 2) -> float:
+        """
+        Returns the spacing of the possible energies (integer couplings), None for other couplings
+        For Q=2 the energy only changes in steps of 2*gcd(J) if every site has an even bond sum
+        """
+        J = np.abs(self.couplings)
+        if not np.all(J == np.round(J)) or not np.any(J):
+            return None
+        g = np.gcd.reduce(J.astype(np.int64))
+        source = np.repeat(np.arange(len(self.spins)), np.diff(self.offsets))
+        weights = np.bincount(source, weights=J / g, minlength=len(self.spins))
+        if q == 2 and np.all(weights % 2 == 0):
+            return float(2 * g)
+        return float(g)
+
+    def IsBipartite(self) -> bool:
+        """
+        Returns True if the sites split into two sublattices with bonds only between them
+        """
+        return TwoColorable(self.offsets, self.neighbors, self.sites)
+
+    def Randomize(self, q: int = 2):
+        """
+        Assigns every lattice point a random state out of [0, q) in one vectorized call
+        """
+        self.spins = np.random.randint(0, q, size=len(self.spins)).astype(np.float64)
+
+    def PrepareEnergy(
+        self, q: int, LB: float, UB: float, J: float = 1.0, max_steps: int = 10e8
+    ) -> float:
+        """
+        Walks the current configuration into the energy window [LB, UB] and returns its energy
+        """
+        energy = WalkToEnergy(
+            self.spins,
+            self.offsets,
+            self.neighbors,
+            self.couplings * J,
+            self.sites,
+            q,
+            LB,
+            UB,
+            int(max_steps),
+        )
+        if energy < LB or energy > UB:
+            raise RuntimeError(
+                f"Could not reach the energy window [{LB}, {UB}] (last energy: {energy})"
+            )
+        return energy
 
-    def NNEnergy(self, J, x, y):
-        s = self.grid[x, y]
-        nnl, nns = GetNNL(self.grid, x, y)
-        energy_contributions = np.array(
-            [-J if s == neighbor else 0 for neighbor in nns]
+    def GridEnergy(self, J):
+        return GraphEnergy(self.spins, self.offsets, self.neighbors, self.couplings * J)
+
+    def NNEnergy(self, J, *position):
+        n = np.ravel_multi_index(position, self.shape)
+        nns = self.spins[self.neighbors[self.offsets[n] : self.offsets[n + 1]]]
+        energy_contributions = np.where(
+            nns == self.spins[n],
+            -J * self.couplings[self.offsets[n] : self.offsets[n + 1]],
+            0.0,
         )  # Kronecker Delta Function
         E = np.sum(energy_contributions)
         return E
@@ -46,24 +165,68 @@ class Lattice:
         """
         Random lattice point selection and returns random position of the lattice
         """
-        i, j = np.random.randint(0, self.size, size=2)
-        return (i, j)
+        n = self.sites[np.random.randint(0, self.particles)]
+        return np.unravel_index(n, self.shape)
 
     def FlipRandPos(self, q):
-        i, j = np.random.randint(0, self.size, size=2)
-        old_state = self.grid[i, j]
+        position = self.RandPos()
+        old_state = self.grid[position]
         possible_states = np.arange(0, q, 1)
         new_state = np.random.choice(possible_states)
-        return (i, j, old_state, new_state)
-
-    def SetPosition(self, i, j, k):
-        self.grid[i, j] = k
+        return (*position, old_state, new_state)
+
+    def SetPosition(self, *position_and_state):
+        *position, k = position_and_state
+        self.grid[tuple(position)] = k
+
+    def WangLandauSteps(
+        self,
+        q,
+        ref,
+        lnge,
+        groups,
+        hist,
+        mask,
+        lnf,
+        energy,
+        LB,
+        UB,
+        nsteps,
+        check,
+        FLATNESS,
+        counters,
+    ):
+        """
+        Performs up to nsteps Wang Landau steps in place, see WangLandauKernel
+        """
+        return WangLandauKernel(
+            self.spins,
+            self.offsets,
+            self.neighbors,
+            self.couplings,
+            self.sites,
+            q,
+            ref,
+            lnge,
+            groups,
+            hist,
+            mask,
+            lnf,
+            energy,
+            LB,
+            UB,
+            nsteps,
+            check,
+            FLATNESS,
+            counters,
+        )
 
     def GetMag(self):
         """
         Returns the overall magnezization M of the lattice. Probably only useful for Q=2 (Ising)
+        States 0 and 1 are mapped onto the spins -1 and +1
         """
-        M = ArraySum(self.grid) / self.particles
+        M = ArraySum(2.0 * self.spins[self.sites] - 1.0) / self.particles
         return M
 
 
@@ -77,49 +240,253 @@ def ArraySum(lattice: np.array):
     return np.sum(lattice)
 
 
-@jit(nopython=True)
-def GetNNL(lattice: np.array, i: int, j: int):
-    """Returns nearest neighbors (version 1.1 with easier boundary conditions)
+def BuildAdjacency(geometry: str, size: int):
+    """Builds the periodic nearest neighbor graph of a lattice in CSR form
+
     Args:
-        lattice (np.array): lattice/grid
-        i (int): i dimension
-        j (int): j dimension
-        i=j for all cases but this is a more genreal version for non-square lattices
+        geometry (str): "square", "triangular", "honeycomb" (brick wall, even size) or "cubic"
+        size (int): linear lattice size
 
     Returns:
-        nnl: nearest neighbor list
-        nns: nearest neighbor states
+        shape, offsets, neighbors
     """
-    N = np.shape(lattice)[0]
-    nnl = [[(i + 1) % N, j], [(i - 1) % N, j], [i, (j + 1) % N], [i, (j - 1) % N]]
+    if geometry == "cubic":
+        shape = (size, size, size)
+        shifts = [
+            (1, 0, 0),
+            (-1, 0, 0),
+            (0, 1, 0),
+            (0, -1, 0),
+            (0, 0, 1),
+            (0, 0, -1),
+        ]
+    elif geometry == "square":
+        shape = (size, size)
+        shifts = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    elif geometry == "triangular":
+        shape = (size, size)
+        shifts = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1)]
+    elif geometry == "honeycomb":
+        if size % 2:
+            raise ValueError("The honeycomb lattice needs an even size")
+        shape = (size, size)
+        shifts = [(0, 1), (0, -1), None]  # None: vertical bond up or down
+    else:
+        raise ValueError(f"Unknown lattice geometry: {geometry}")
+
+    coords = np.indices(shape).reshape(len(shape), -1)
+    columns = []
+    for shift in shifts:
+        if shift is None:
+            shift = np.stack([1 - 2 * (np.sum(coords, axis=0) % 2), 0 * coords[1]])
+        else:
+            shift = np.array(shift)[:, None]
+        columns.append(np.ravel_multi_index(tuple((coords + shift) % size), shape))
+
+    neighbors = np.stack(columns, axis=1).reshape(-1)
+    offsets = np.arange(0, len(neighbors) + 1, len(shifts))
+    return (shape, offsets, neighbors)
+
+
+def DiluteAdjacency(offsets: np.array, neighbors: np.array, occupied: np.array):
+    """Removes all bonds that touch an empty site from a CSR adjacency
+
+    Args:
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        occupied (np.array): True for every occupied site
 
-    nns = [lattice[index[0], index[1]] for index in nnl]
-    return nnl, np.array(nns)
+    Returns:
+        offsets, neighbors
+    """
+    source = np.repeat(np.arange(len(occupied)), np.diff(offsets))
+    keep = occupied[source] & occupied[neighbors]
+    counts = np.bincount(source[keep], minlength=len(occupied))
+    return (np.concatenate(([0], np.cumsum(counts))), neighbors[keep])
 
 
 @jit(nopython=True)
-def CalculateEnergy(lattice: np.array, J: float = 1.0) -> float:
-    """Calculate energy of a given system without external field contributions
+def TwoColorable(offsets: np.array, neighbors: np.array, sites: np.array) -> bool:
+    """Checks whether a CSR graph is bipartite (breadth first search)
 
     Args:
-        lattice (np.array): lattice/grid
-        J (float): coupling constant. Defaults to 1.
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        sites (np.array): occupied sites
+
+    Returns:
+        bool: True if bipartite
+    """
+    colors = -np.ones(len(offsets) - 1, dtype=np.int64)
+    queue = np.empty(len(offsets) - 1, dtype=np.int64)
+    for start in sites:
+        if colors[start] >= 0:
+            continue
+        colors[start] = 0
+        queue[0] = start
+        head = 0
+        tail = 1
+        while head < tail:
+            n = queue[head]
+            head += 1
+            for b in range(offsets[n], offsets[n + 1]):
+                m = neighbors[b]
+                if colors[m] < 0:
+                    colors[m] = 1 - colors[n]
+                    queue[tail] = m
+                    tail += 1
+                elif colors[m] == colors[n]:
+                    return False
+    return True
+
+
+@jit(nopython=True)
+def GraphEnergy(
+    spins: np.array, offsets: np.array, neighbors: np.array, couplings: np.array
+) -> float:
+    """Calculate energy of a configuration on a CSR graph without external field contributions
+
+    Args:
+        spins (np.array): states of all sites
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        couplings (np.array): coupling constant of every (directed) bond
 
     Returns:
         float: lattice energy
     """
     energy = 0.0
-    for x in range(lattice.shape[0]):
-        for y in range(lattice.shape[1]):
-            s = lattice[x, y]  # Current lattice position
-            nnl, nns = GetNNL(lattice, x, y)  # Get current lattice position's neighbors
-            energy_contributions = np.array(
-                [-J if s == neighbor else 0 for neighbor in nns]
-            )  # Kronecker Delta Function
-            energy += np.sum(energy_contributions)  # Sum over all N lattice sites
+    for n in range(len(spins)):
+        for b in range(offsets[n], offsets[n + 1]):
+            if spins[neighbors[b]] == spins[n]:  # Kronecker Delta Function
+                energy -= couplings[b]
     return energy / 2.0
 
 
+@jit(nopython=True)
+def DeltaEnergy(
+    spins: np.array,
+    offsets: np.array,
+    neighbors: np.array,
+    couplings: np.array,
+    n: int,
+    k: float,
+) -> float:
+    """Energy change when site n is set to state k (only the bonds of n change)
+
+    Args:
+        spins (np.array): states of all sites
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        couplings (np.array): coupling constant of every (directed) bond
+        n (int): site
+        k (float): new state
+
+    Returns:
+        float: E(new) - E(old)
+    """
+    s = spins[n]
+    delta = 0.0
+    for b in range(offsets[n], offsets[n + 1]):
+        neighbor = spins[neighbors[b]]
+        if neighbor == s:
+            delta += couplings[b]
+        if neighbor == k:
+            delta -= couplings[b]
+    return delta
+
+
+@jit(nopython=True)
+def HighEnergyState(
+    spins: np.array,
+    offsets: np.array,
+    neighbors: np.array,
+    couplings: np.array,
+    sites: np.array,
+    q: int,
+):
+    """Greedy high energy configuration, in place: every site takes the state with the smallest
+    sum of satisfied couplings to the sites before it (checkerboard for Q=2 on bipartite lattices)
+
+    Args:
+        spins (np.array): states of all sites
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        couplings (np.array): coupling constant of every (directed) bond
+        sites (np.array): occupied sites
+        q (int): number of possible states
+    """
+    assigned = np.zeros(len(spins), dtype=np.bool_)
+    for n in sites:
+        satisfied = np.zeros(q)
+        for b in range(offsets[n], offsets[n + 1]):
+            if assigned[neighbors[b]]:
+                satisfied[int(spins[neighbors[b]])] += couplings[b]
+        spins[n] = float(np.argmin(satisfied))
+        assigned[n] = True
+
+
+@jit(nopython=True)
+def WalkToEnergy(
+    spins: np.array,
+    offsets: np.array,
+    neighbors: np.array,
+    couplings: np.array,
+    sites: np.array,
+    q: int,
+    LB: float,
+    UB: float,
+    max_steps: int,
+) -> float:
+    """Moves a configuration in place into the energy window [LB, UB] with single site changes
+
+    Changes that bring the energy closer to the window center are always accepted,
+    all others with probability exp(-b*d), where d is the increase of the distance to the center
+    and b grows by one every sweep up to BMAX (annealing). Half of the proposals copy the state of a
+    neighbor, which keeps the walk efficient for large q. Lowering the energy of a disordered
+    lattice gets stuck in striped domains, so a lattice above the window is first reset to
+    a uniform ground state and then walked upwards. Likewise a lattice below the window is reset
+    to a high energy state (HighEnergyState) and walked downwards.
+
+    Args:
+        spins (np.array): states of all sites
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        couplings (np.array): coupling constant of every (directed) bond
+        sites (np.array): occupied sites
+        q (int): number of possible states
+        LB (float): lower energy bound
+        UB (float): upper energy bound
+        max_steps (int): maximum number of proposed changes
+
+    Returns:
+        float: energy of the final configuration
+    """
+    target = 0.5 * (LB + UB)
+    energy = GraphEnergy(spins, offsets, neighbors, couplings)
+    if energy > UB:
+        spins[sites] = spins[sites[0]]
+        energy = GraphEnergy(spins, offsets, neighbors, couplings)
+    elif energy < LB:
+        HighEnergyState(spins, offsets, neighbors, couplings, sites, q)
+        energy = GraphEnergy(spins, offsets, neighbors, couplings)
+    for step in range(max_steps):
+        if energy >= LB and energy <= UB:
+            break
+        n = sites[np.random.randint(0, len(sites))]
+        if np.random.rand() < 0.5 or offsets[n] == offsets[n + 1]:
+            k = float(np.random.randint(0, q))
+        else:
+            k = spins[neighbors[offsets[n]]]
+        delta = DeltaEnergy(spins, offsets, neighbors, couplings, n, k)
+        d = abs(energy + delta - target) - abs(energy - target)
+        b = min(1.0 + step / len(sites), BMAX)
+        if d <= 0.0 or np.random.rand() < np.exp(-b * d):
+            spins[n] = k
+            energy += delta
+    return energy
+
+
 @jit(nopython=True)
 def GetDeltaIndex(array: np.array, number: float) -> int:
     """Returns the belonging of an energy value (number) to a energy bin (array)
@@ -136,6 +503,265 @@ def GetDeltaIndex(array: np.array, number: float) -> int:
     return index - 1
 
 
+def HistogramWeights(groups: np.array, mask: np.array) -> np.array:
+    """Weight of every histogram bin in the flatness criterion: one over the number of possible
+    energy bins it holds (merged bins collect the visits of all of them), 0 for excluded bins
+
+    Args:
+        groups (np.array): histogram bin of every energy bin
+        mask (np.array): energy bins that are possible
+
+    Returns:
+        np.array: weights
+    """
+    sizes = np.bincount(groups, weights=mask)
+    return np.where(sizes > 0, 1.0 / np.maximum(sizes, 1), 0.0)
+
+
+@jit(nopython=True)
+def HistogramFlat(hist: np.array, mask: np.array, FLATNESS: float) -> bool:
+    """WLA flatness criterion on the bins in mask (the mean is taken over all bins)
+
+    Args:
+        hist (np.array): current histogram
+        mask (np.array): weight of every bin, 0 for bins that do not take part (see HistogramWeights)
+        FLATNESS (float): WLA flatness
+
+    Returns:
+        bool: True if the histogram is flat
+    """
+    hmin = np.inf
+    hsum = 0.0
+    for b in range(len(hist)):
+        if mask[b] > 0:
+            hmin = min(hmin, hist[b] * mask[b])
+            hsum += hist[b] * mask[b]
+    return hmin > hsum / len(hist) * FLATNESS  # WLA FLATNESS Criterion
+
+
+@jit(nopython=True)
+def WangLandauKernel(
+    spins: np.array,
+    offsets: np.array,
+    neighbors: np.array,
+    couplings: np.array,
+    sites: np.array,
+    q: int,
+    ref: np.array,
+    lnge: np.array,
+    groups: np.array,
+    hist: np.array,
+    mask: np.array,
+    lnf: float,
+    energy: float,
+    LB: float,
+    UB: float,
+    nsteps: int,
+    check: int,
+    FLATNESS: float,
+    counters: np.array,
+):
+    """Compiled Wang Landau steps on a CSR graph. spins, lnge and hist are updated in place.
+
+    Args:
+        spins (np.array): states of all sites
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        couplings (np.array): coupling constant of every (directed) bond
+        sites (np.array): occupied sites
+        q (int): number of possible states
+        ref (np.array): energy bins
+        lnge (np.array): current DOS estimate
+        groups (np.array): histogram bin of every energy bin
+        hist (np.array): current histogram
+        mask (np.array): weights of the histogram bins in the flatness criterion (see HistogramWeights)
+        lnf (float): current ln(f)
+        energy (float): energy of the current configuration
+        LB (float): lower energy bound
+        UB (float): upper energy bound
+        nsteps (int): maximum number of steps
+        check (int): the flatness is checked every check steps
+        FLATNESS (float): WLA flatness
+        counters (np.array): cycles per phase, see functions_profile (empty: no profiling)
+
+    Returns:
+        energy of the final configuration, number of performed steps, True if the histogram is flat
+    """
+    profile = len(counters) > 0
+    start = 0
+    index_eold = GetDeltaIndex(ref, energy)
+    for iter in range(nsteps):
+        EnergyCheck = False
+        while not EnergyCheck:
+            if profile:
+                start = ReadCycles()
+            n = sites[np.random.randint(0, len(sites))]
+            k = float(np.random.randint(0, q))
+            if profile:
+                now = ReadCycles()
+                counters[PROPOSAL_PHASE] += now - start
+                start = now
+            enew = energy + DeltaEnergy(spins, offsets, neighbors, couplings, n, k)
+            if profile:
+                now = ReadCycles()
+                counters[ENERGY_PHASE] += now - start
+                start = now
+            if enew <= UB and enew >= LB:
+                EnergyCheck = True
+
+        index_enew = GetDeltaIndex(ref, enew)
+
+        dos_ratio = np.exp(lnge[index_eold] - lnge[index_enew])  # Difference in DOS
+
+        if dos_ratio >= 1.0 or np.random.rand() < dos_ratio:  # WLA Criterion
+            spins[n] = k
+            energy = enew
+            index_eold = index_enew
+
+        hist[groups[index_eold]] += 1
+        lnge[index_eold] += lnf
+
+        if profile:
+            now = ReadCycles()
+            counters[BINNING_PHASE] += now - start
+            start = now
+
+        if iter % check == 0:
+            flat = HistogramFlat(hist, mask, FLATNESS)
+            if profile:
+                counters[FLATNESS_PHASE] += ReadCycles() - start
+            if flat:
+                return (energy, iter + 1, True)
+
+    return (energy, nsteps, False)
+
+
+@jit(nopython=True)
+def SeedKernels(seed: int):
+    """Seeds the random number generator of the compiled functions (separate from NumPy's)"""
+    np.random.seed(seed)
+
+
+def Seed(seed: int):
+    """Seeds all random number generators (random, NumPy and the compiled functions)
+
+    Args:
+        seed (int): seed
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    SeedKernels(seed)
+
+
+def EnergyLevels(LB: float, UB: float, STEP: float) -> np.array:
+    """Energy levels LB, LB + STEP, ... up to UB (UB itself is only included if it is a level)
+
+    Args:
+        LB (float): Lower energy bound
+        UB (float): Upper energy bound
+        STEP (float): Spacing of the energy levels (see Lattice.EnergySpacing)
+
+    Returns:
+        np.array: energy levels
+    """
+    return LB + STEP * np.arange(int(np.floor((UB - LB) / STEP + 1e-9)) + 1)
+
+
+def WangLandauRefined(
+    lattice: Lattice,
+    LB: float,
+    UB: float,
+    STEP: float = 1.0,
+    COARSE_BINS: int = 32,
+    STAGES: int = 4,
+    MAX_STEPS: int = 10e8,
+    INTERVAL: int = 1000,
+    FLATNESS: float = 0.8,
+    CONTROLF: float = 10e-8,
+    q: int = 2,
+    PROGRESS=None,
+    PROFILE=None,
+    **kwargs,
+):
+    """Coarse-to-fine Wang Landau Algorithm
+
+    lng(E) is always sampled per energy level E = LB, LB + STEP, ..., UB, but the flatness is first
+    checked on at most COARSE_BINS merged histogram bins. The merged bins are split in half after
+    every STAGES lnf stages until every energy level has its own histogram bin. Each level starts
+    from the lnf and lnge reached so far. Energy levels that were never visited on the coarse
+    levels are excluded from the start of the next level, instead of spending MAX_STEPS on
+    finding them. Coarse levels are skipped once lnf gets close to CONTROLF. The refinement
+    stops if a level does not converge within MAX_STEPS.
+
+    Args:
+        lattice (Lattice class): the grid/lattice object
+        LB (float): Lower energy bound
+        UB (float): Upper energy bound
+        STEP (float, optional): Spacing of the energy levels (see Lattice.EnergySpacing). Defaults to 1.0.
+        COARSE_BINS (int, optional): Maximum number of histogram bins of the first level. Defaults to 32.
+        STAGES (int, optional): Number of lnf stages of every coarse level. Defaults to 4.
+        MAX_STEPS, INTERVAL, FLATNESS, CONTROLF, q, PROGRESS, PROFILE: see WangLandau
+        kwargs: passed on to WangLandau for every level (e.g. HISTORY, TOLERANCE)
+
+    Returns:
+        energy bins, lnge, last histogram, reached ln(f) (see WangLandau)
+    """
+    ref = EnergyLevels(LB, UB, STEP)
+    levels = len(ref)
+    width = 1  # Energy levels per histogram bin
+    while levels / width > COARSE_BINS:
+        width *= 2
+
+    lnge = np.zeros(levels)
+    mask = np.ones(levels, dtype=bool)
+    lnf = 1.0
+    first = True
+    floor = CONTROLF * 2**STAGES  # The final level runs at least STAGES lnf stages
+    while width >= 1:
+        final = width == 1
+        stop = CONTROLF if final else max(lnf / 2**STAGES, floor)
+        if lnf <= stop:
+            width //= 2
+            continue  # lnf is already small, go directly to a finer level
+
+        # The last histogram bin also holds the remaining levels up to UB
+        groups = np.minimum(np.arange(levels) // width, max(levels // width, 1) - 1)
+        print("-------------------")
+        print(f"Refinement: {groups[-1] + 1} histogram bins of {width} energy levels")
+
+        REF, LNGE, HIST, reached = WangLandau(
+            lattice,
+            ref,
+            MAX_STEPS,
+            NBINS=levels,
+            INTERVAL=INTERVAL,
+            FLATNESS=FLATNESS,
+            CONTROLF=stop,
+            q=q,
+            LB=LB,
+            UB=UB,
+            PROGRESS=PROGRESS,
+            LNGE=lnge,
+            LNF=lnf,
+            GROUPS=groups,
+            MASK=mask,
+            EXCLUDE=first,  # Only the first stage of the whole run excludes bins
+            PROFILE=PROFILE,
+            **kwargs,
+        )
+        first = False
+        if reached > stop:
+            print("Refinement stopped, no convergence with", groups[-1] + 1, "bins")
+            return (REF, LNGE, HIST, reached)
+        index = np.round((REF * lattice.particles - LB) / STEP).astype(int)
+        lnge[index] = LNGE
+        mask = lnge != 0  # lnge only stays 0 on energy levels that were never visited
+        lnf = reached
+        width //= 2
+
+    return (REF, LNGE, HIST, reached)
+
+
 def PrintLNF(lnf: float):
     """Just a pretty print function
 
@@ -209,6 +835,16 @@ def WangLandau(
     q: int = 2,
     LB: float = -2.0,
     UB: float = 0.0,
+    HISTORY=None,
+    SNAPSHOTS: int = 0,
+    TOLERANCE: float = 0.0,
+    PROGRESS=None,
+    LNGE: np.array = None,
+    LNF: float = 1.0,
+    GROUPS: np.array = None,
+    MASK: np.array = None,
+    EXCLUDE: bool = True,
+    PROFILE=None,
 ):
     """The actual Wang Landau Algorithm
 
@@ -218,23 +854,37 @@ def WangLandau(
         MAX_STEPS (int, optional): Maximum steps for convergence for every lnf step. Defaults to 10e8.
         NBINS (int, optional): Number of energy bins. Defaults to 500.
         INTERVAL (int, optional): Printing Interval for Updates. Defaults to 1000.
-        L (int, optional): Lattice Size. Defaults to 10.
+        L (int, optional): Lattice Size, unused (one MC sweep is lattice.particles steps). Defaults to 10.
         FLATNESS (float, optional):  WLA flatness. Defaults to 0.8.
         CONTROLF (float, optional): WLA final lnf=10e-8 criterion.. Defaults to 10e-8.
         DIRECTORY_NAME (str, optional): Current Experiment name. Defaults to "samplerun".
         q (int, optional): Number of possible states. Defaults to 8.
         LB (float, optional): Lower energy bound. Defaults to -2.0.
         UB (float, optional): Upper energy bound. Defaults to 0.0.
+        HISTORY (HistoryWriter, optional): Receives a snapshot at the end of every lnf stage. Defaults to None.
+        SNAPSHOTS (int, optional): Additional snapshot every SNAPSHOTS printing intervals (0: off). Defaults to 0.
+        TOLERANCE (float, optional): Stop early once two successive lnf stages agree within TOLERANCE (0: off). Defaults to 0.0.
+        PROGRESS (callable, optional): Called as PROGRESS(lnf, iter, flatness) every printing interval. Defaults to None.
+        LNGE (np.array, optional): Initial DOS estimate on the bins ref. Defaults to None (lnge=0).
+        LNF (float, optional): Initial ln(f). Defaults to 1.0.
+        GROUPS (np.array, optional): Histogram bin of every energy bin, the flatness is checked on the merged bins. Defaults to None (one per energy bin).
+        MASK (np.array, optional): Energy bins that are known to be possible. Defaults to None (all).
+        EXCLUDE (bool, optional): Exclude the bins that stay empty if the first lnf stage does not converge. Defaults to True.
+        PROFILE (Profiler, optional): Collects the time per phase, see functions_profile. Defaults to None.
 
     Returns:
-        energy bins, lnge, last histogram
+        energy bins, lnge, last histogram and the reached ln(f): the lnf of the stage that did not
+        converge within MAX_STEPS, otherwise at most CONTROLF (0 after an early stop)
     """
 
-    MCS = L**2
+    MCS = lattice.particles
     N = NBINS
-    lnge = np.zeros(NBINS)  # Initial DOS = 0
-    lnf = 1.0  # Initial f = e
+    lnge = np.zeros(NBINS) if LNGE is None else np.array(LNGE, dtype=np.float64)
+    initial_lnge = lnge.copy()  # Energy bins that keep it were never visited
+    lnf = LNF  # Initial f = e by default
     MAX_STEPS = int(MAX_STEPS)
+    groups = np.arange(NBINS) if GROUPS is None else np.asarray(GROUPS)
+    profile = NO_PROFILE if PROFILE is None else PROFILE
 
     possible_states = np.arange(
         0, q, 1
@@ -256,98 +906,117 @@ def WangLandau(
     Also exclude upper and lower energy boundaries
     """
     # empty_bins, empty_energies = BinChecking(MAX_STEPS, lattice, ref, q, LB, UB)
-    mask = np.ones(len(ref), dtype=bool)
+    mask = np.ones(len(ref), dtype=bool) if MASK is None else np.array(MASK)
     exclude_bins = [i for i, e in enumerate(ref) if e > UB or e < LB]
     mask[exclude_bins] = False
+    hist_mask = HistogramWeights(groups, mask)
 
     print("Maximal ln(f)", CONTROLF)
 
-    while lnf > CONTROLF:  # This loops controls the precision of the algorithm
-        PrintLNF(lnf)
-        hist = np.zeros(NBINS)  # Resetting the histogram
-
-        for iter in range(
-            MAX_STEPS
-        ):  # Abort if no convergence is reached after MAX_STEPS
-
-            ene = lattice.GridEnergy(J=1)
-
-            EnergyCheck = False
-            while not EnergyCheck:
-                i, j, old_state, new_state = lattice.FlipRandPos(q)
-                lattice.SetPosition(i, j, new_state)
-                enew = lattice.GridEnergy(1)
-                if enew <= UB and enew >= LB:
-                    EnergyCheck = True
-                else:
-                    lattice.SetPosition(i, j, old_state)
-
-            index_eold = GetDeltaIndex(ref, ene)
-            index_enew = GetDeltaIndex(ref, enew)
+    energy = lattice.GridEnergy(J=1)
+
+    last_stage = None
+    stage_number = 0
+    converged = True
+
+    while (
+        lnf > CONTROLF and converged
+    ):  # This loops controls the precision of the algorithm
+        with profile.Phase("io"):
+            PrintLNF(lnf)
+        hist = np.zeros(groups[-1] + 1)  # Resetting the histogram
+        stage_lnf = lnf
+
+        iter = 0
+        chunks = 0
+        while iter < MAX_STEPS:  # Abort if no convergence is reached after MAX_STEPS
+            # The compiled kernel runs until the histogram is flat or the next progress print
+            with profile.Phase("kernel"):
+                energy, steps, flat = lattice.WangLandauSteps(
+                    q,
+                    ref,
+                    lnge,
+                    groups,
+                    hist,
+                    hist_mask,
+                    lnf,
+                    energy,
+                    LB,
+                    UB,
+                    min(MCS * INTERVAL, MAX_STEPS - iter),
+                    MCS,
+                    FLATNESS,
+                    profile.counters,
+                )
+            iter += steps
+            with profile.Phase("reductions"):
+                actual_hist = (hist * hist_mask)[hist_mask > 0]
+                flatness = (
+                    np.min(actual_hist) * len(hist) / (np.sum(actual_hist) * FLATNESS)
+                )
 
-            dos_ratio = np.exp(lnge[index_eold] - lnge[index_enew])  # Difference in DOS
+            if flat:
+                with profile.Phase("io"):
+                    print("Reached convergence after", iter - 1, "steps.")
+                    print("Hist FLATNESS: ", np.round(flatness, 3))
+                lnf /= 2  # f(t+1) = sqrt(f(t))
+                break  # Escape the loop and start with new lnf
 
-            if dos_ratio >= 1.0 or np.random.rand() < dos_ratio:  # WLA Criterion
-                hist[index_enew] += 1
-                lnge[index_enew] += lnf
-                # print(enew)
+            with profile.Phase("io"):
+                # Printing current progress every MCS*INTERVAL steps
+                print("Current Iteration: ", iter)
+                print("Hist FLATNESS: ", np.round(flatness, 3))
+                print("Smallest Bin: ", np.argmin(actual_hist))
+                print("Current Energy: ", energy)
 
-            else:  # Update the current bins and change back to the original k configuration
-                hist[index_eold] += 1
-                lnge[index_eold] += lnf
-                lattice.SetPosition(i, j, old_state)
+                if PROGRESS is not None:
+                    PROGRESS(lnf, iter, flatness)
 
-            if iter % MCS == 0:
-                actual_hist = hist[mask]
-                if (
-                    np.min(actual_hist) > np.sum(actual_hist) / NBINS * FLATNESS
-                ):  # WLA FLATNESS Criterion
-                    print("Reached convergence after", iter, "steps.")
-                    print(
-                        "Hist FLATNESS: ",
-                        np.round(
-                            np.min(actual_hist)
-                            * NBINS
-                            / (np.sum(actual_hist) * FLATNESS),
-                            3,
-                        ),
+                chunks += 1
+                if HISTORY is not None and SNAPSHOTS > 0 and chunks % SNAPSHOTS == 0:
+                    HISTORY.Append(
+                        INTERVAL_SNAPSHOT, iter, lnf, lnge, hist[groups], mask
                     )
-                    lnf /= 2  # f(t+1) = sqrt(f(t))
-                    break  # Escape the loop and start with new lnf
 
-            if (
-                iter % (MCS * INTERVAL) == 0
-            ):  # Printing current progress every MCS*INTERVAL steps
-                actual_hist = hist[mask]
-                print("Current Iteration: ", iter)
-                print(
-                    "Hist FLATNESS: ",
-                    np.round(
-                        np.min(actual_hist) * NBINS / (np.sum(actual_hist) * FLATNESS),
-                        3,
-                    ),
+        else:  # If no convergence is reached, stop the sampling --> breaks out of the while loop
+            if stage_number == 0 and EXCLUDE:
+                # Per energy bin, a merged histogram bin can hold levels that are impossible
+                empty_bins = [i for i, e in enumerate(lnge) if e == initial_lnge[i]]
+                print("Excluded the following bins for subsequent runs:")
+                print(empty_bins)
+                mask[empty_bins] = False
+                hist_mask = HistogramWeights(groups, mask)
+                lnf /= 2
+
+            else:
+                print("Reached no convergence after", MAX_STEPS, "steps.")
+                print("Reached lnf=", lnf)
+                print("Smallest bin:", np.argmin(actual_hist))
+                print("with count:", np.min(actual_hist))
+                converged = False
+        stage_number += 1
+
+        if HISTORY is not None:
+            with profile.Phase("io"):
+                HISTORY.Append(
+                    STAGE_SNAPSHOT, iter, stage_lnf, lnge, hist[groups], mask
                 )
-                print("Smallest Bin: ", np.argmin(actual_hist))
-                print("Current Energy: ", enew)
-
-            if (
-                iter == MAX_STEPS - 1
-            ):  # If no convergence is reached, stop the sampling by setting lnf=0 --> breaks out of the while loop
-                if lnf == 1.0:
-                    empty_bins = [i for i, e in enumerate(hist) if e == 0]
-                    print("Excluded the following bins for subsequent runs:")
-                    print(empty_bins)
-                    mask[empty_bins] = False
-                    lnf /= 2
-
-                else:
-                    print("Reached no convergence after", MAX_STEPS, "steps.")
-                    print("Reached lnf=", lnf)
-                    print("Smallest bin:", np.argmin(actual_hist))
-                    print("with count:", np.min(actual_hist))
+            if HISTORY.StopRequested() and converged:
+                print("Stop requested, finishing with lnf=", stage_lnf)
+                lnf = 0
+
+        if TOLERANCE > 0 and converged:  # Compare with the previous lnf stage
+            stage = {"lnge": lnge.copy(), "mask": mask.copy()}
+            if last_stage is not None:
+                difference = SnapshotDifference(last_stage, stage)
+                print("Change since the last lnf stage: ", np.round(difference, 6))
+                if difference < TOLERANCE:
+                    print("Converged within tolerance", TOLERANCE)
                     lnf = 0
+            last_stage = stage
 
-        actual_hist = hist[mask] / np.max(hist[mask])
+        actual_hist = (hist * hist_mask)[groups][mask]
+        actual_hist = actual_hist / np.max(actual_hist)
         actual_lnge = lnge[mask]
         actual_ref = ref[mask] / lattice.particles
 
@@ -355,4 +1024,5 @@ def WangLandau(
         actual_ref,
         actual_lnge,
         actual_hist,
-    )  # Returns the energy bins ref/N, the DOS lnge, and the last normalized histogram hist
+        lnf,
+    )  # Returns the energy bins ref/N, the DOS lnge, the last normalized histogram hist and ln(f)
@@ -6,9 +6,12 @@ MC Simulation for Q-State Potts Model with Wang Landau Algorithm
 Accounts for possible high exponents by calculating only ln values according to DOI: 10.1119/1.1707017
 """
 
+import json
+import os
 import pandas as pd  # type: ignore
 import numpy as np
 import matplotlib.pyplot as plt
+from functions_reweighting import ArrayChunks, StreamDistribution, StreamThermo
 
 
 def Normalize(array: pd.DataFrame, Q: int, size: int):
@@ -29,6 +32,7 @@ def Normalize(array: pd.DataFrame, Q: int, size: int):
 
 def MirrorDataAndNormalize(array: pd.DataFrame):
     """Normalize lng(E) data and mirror it for Z2 symmetry of Q2 Potts Model
+    Mirrors at E=0 (Ising convention of the example data), use LoadResult for new runs
 
     Args:
         array (pd.DataFrame): results from the WLA analysis
@@ -58,73 +62,121 @@ def MirrorDataAndNormalize(array: pd.DataFrame):
     return (x, y)
 
 
-def MLOThermo(T, energies, lnge, N, k: float = 1):
-    """Calculate thermodynamic data
+def ReconstructSymmetric(energies, lnge, center: float):
+    """Reconstruct the full lng(E) from the irreducible half E <= center of a symmetric run
+    (g(E) = g(2*center - E), see the --symmetric option of main.py). The center is not always
+    an energy of the lattice (odd number of bonds), a sample at the center is not duplicated.
 
     Args:
-        T (_type_): Temperature
-        energies (_type_): E
+        energies (_type_): E up to the center
         lnge (_type_): lng(E)
-        N (_type_): number of lattice sites
-        k (float, optional): Boltzmann constant. Defaults to 1.
+        center (float): symmetry center in the units of energies
 
     Returns:
-        _type_: (F,U,C,S) thermodynamical data
+        _type_: returns x,y = E and lng(E) over the full energy range
     """
-    # Find the maximum exponent lambda (DOI: 10.1119/1.1707017)
+    x1 = np.asarray(energies, dtype=np.float64)
+    y1 = np.asarray(lnge, dtype=np.float64)
+    at_center = np.isclose(x1[-1], center)
+    if x1[-1] > center and not at_center:
+        raise ValueError(f"The data end at E={x1[-1]}, beyond the center {center}")
+    half = len(x1) - 1 if at_center else len(x1)
+    x2 = np.flip(2 * center - x1[:half])
+    y2 = np.flip(y1[:half])
+    return (np.concatenate((x1, x2)), np.concatenate((y1, y2)))
 
-    energies = np.array(energies) * N**2
 
-    exponents = []
-    for L, E in zip(lnge, energies):
-        exponents.append(L - E / (k * T))
-    exponents = np.array(exponents)
-    maxval = np.max(exponents)
+def MetaPath(path: str) -> str:
+    """Returns the metadata file that belongs to a result file"""
+    return os.path.splitext(path)[0] + ".json"
 
-    # Calculate F(T), U(T), C(T), and S(T)
-    sigma = 0
-    mu = 0
-    kappa = 0
-    for L, E in zip(lnge, energies):
-        exponent = np.exp(L - E / (k * T) - maxval)
-        sigma += exponent
-        mu += exponent * E
-        kappa += exponent * E * E
 
-    lnZ = maxval + np.log(sigma)
-    F = (-k * T * lnZ) / N
+def LoadResult(path: str, Q: int = None):
+    """Load and normalize a WLA result in the energy units of MLOThermo and BoltzmannDist
+    (E/N^2 like the example data, runs with metadata store E/N). Results of symmetric runs are
+    mirrored automatically. Files without metadata are example data, of which only Q=2 is
+    mirrored (at E=0, see MirrorDataAndNormalize), so the Z2 mirror cannot end up on Q>2 data.
 
-    U = mu / (sigma * N)
+    Args:
+        path (str): result file (out_final.txt)
+        Q (int, optional): number of possible Q states, only needed without metadata file
 
-    C = ((kappa / sigma) - (mu / sigma) ** 2) / (k * T * N)
+    Returns:
+        _type_: returns x,y,meta = E/N^2, lng(E) and the run metadata
+    """
+    data = pd.read_csv(path)
+    if not os.path.exists(MetaPath(path)):
+        if Q is None:
+            raise ValueError(f"{path} has no metadata, Q is needed")
+        x, y = MirrorDataAndNormalize(data) if Q == 2 else Normalize(data, Q, None)
+        return (np.asarray(x), np.asarray(y), {"qstates": Q})
+
+    with open(MetaPath(path)) as f:
+        meta = json.load(f)
+    N = meta["particles"]
+    x, y = Normalize(data, meta["qstates"], N)
+    if meta.get("center") is not None:
+        x, y = ReconstructSymmetric(x, y, meta["center"])
+    return (np.asarray(x) / N, np.asarray(y), meta)
 
-    S = (U - F) / T
 
-    return (F, U, C, S)
+def MLOThermo(T, energies, lnge, N, k: float = 1):
+    """Calculate thermodynamic data (see functions_reweighting.StreamThermo)
+
+    Args:
+        T (_type_): Temperature, or an array of temperatures
+        energies (_type_): E/N^2 (see LoadResult, ThermoArrays takes total energies)
+        lnge (_type_): lng(E)
+        N (_type_): number of lattice sites
+        k (float, optional): Boltzmann constant. Defaults to 1.
+
+    Returns:
+        _type_: (F,U,C,S) thermodynamical data, arrays for an array of temperatures
+    """
+    # Only ln values are accumulated, starting from the maximum exponent (DOI: 10.1119/1.1707017)
+    energies = np.asarray(energies, dtype=np.float64) * N**2
+    thermo = StreamThermo(
+        np.atleast_1d(T), ArrayChunks(energies, np.asarray(lnge)), N, k
+    )
+    if np.ndim(T) == 0:
+        return tuple(float(value[0]) for value in thermo)
+    return thermo
 
 
 def BoltzmannDist(energies, lnge, N, T, color, label):
     """Calculate Boltzmann Distributions
 
     Args:
-        energies (_type_): E
+        energies (_type_): E/N^2 (see LoadResult)
         lnge (_type_): lng(E)
         N (_type_): lattice sites
         T (_type_): temperature
         color (_type_): color
         label (_type_): sample name or label
     """
-    k = 1
-    energies = np.array(energies) * N * N
-    exponents = []
-    for L, E in zip(lnge, energies):
-        exponents.append(L - E / (k * T))
-    exponents = np.array(exponents)
-    maxval = np.max(exponents)
-
-    # Calculate g(e)*exp(-E/T)
-    dist = []
-    for L, E in zip(lnge, energies):
-        dist.append(np.exp(L - E / (k * T) - maxval))
-    plt.plot(energies / N, dist, "ko-", color=color, label=label, alpha=0.6)
+    energies = np.asarray(energies, dtype=np.float64) * N * N
+    source = ArrayChunks(energies, np.asarray(lnge))
+
+    # Calculate g(e)*exp(-E/T) relative to its maximum
+    chunks = list(StreamDistribution(T, source, k=1, PEAK=True))
+    E = np.concatenate([E for E, P in chunks])
+    dist = np.concatenate([P for E, P in chunks])
+    plt.plot(E / N, dist, "ko-", color=color, label=label, alpha=0.6)
     plt.xlim(-2.1, 0)
+
+
+def ThermoArrays(temps, energies, lnge, N, k: float = 1):
+    """Calculate thermodynamic data for many temperatures at once (see StreamThermo)
+
+    Args:
+        temps (_type_): temperatures
+        energies (_type_): total energies E (not divided by N)
+        lnge (_type_): lng(E)
+        N (_type_): number of lattice sites
+        k (float, optional): Boltzmann constant. Defaults to 1.
+
+    Returns:
+        _type_: (F,U,C,S) arrays with one value per temperature
+    """
+    source = ArrayChunks(np.asarray(energies), np.asarray(lnge))
+    return StreamThermo(temps, source, N, k)
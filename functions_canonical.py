@@ -0,0 +1,244 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Canonical (fixed temperature) Metropolis and heat-bath sampling as a cross-check for the WLA.
+The lattice is split into sublattices without internal bonds (checkerboard for the square lattice),
+so every sublattice is updated in one vectorized NumPy pass.
+
+"""
+
+import numpy as np  # type: ignore
+from numba import jit  # type: ignore
+from functions import Lattice
+
+
+@jit(nopython=True)
+def GreedyColoring(offsets: np.array, neighbors: np.array, sites: np.array):
+    """Colors the sites such that no two neighbors share a color (smallest free color first)
+
+    Args:
+        offsets (np.array): CSR offsets
+        neighbors (np.array): CSR neighbor indices
+        sites (np.array): occupied sites
+
+    Returns:
+        np.array: color of every site (-1 for empty sites)
+    """
+    colors = -np.ones(len(offsets) - 1, dtype=np.int64)
+    for n in sites:
+        used = np.zeros(offsets[n + 1] - offsets[n] + 1, dtype=np.bool_)
+        for b in range(offsets[n], offsets[n + 1]):
+            c = colors[neighbors[b]]
+            if c >= 0 and c < len(used):
+                used[c] = True
+        c = 0
+        while used[c]:
+            c += 1
+        colors[n] = c
+    return colors
+
+
+def Sublattices(lattice: Lattice):
+    """Splits the lattice into sublattices without internal bonds
+
+    Args:
+        lattice (Lattice): the grid/lattice object
+
+    Returns:
+        list of (sites, neighbors, couplings); neighbors and couplings are padded to the
+        largest coordination number (padding: coupling 0)
+    """
+    colors = GreedyColoring(lattice.offsets, lattice.neighbors, lattice.sites)
+    degree = np.diff(lattice.offsets)
+    width = np.max(degree)
+    tables = []
+    for c in range(np.max(colors) + 1):
+        sites = np.flatnonzero(colors == c)
+        slots = np.arange(width)[None, :]
+        valid = slots < degree[sites][:, None]
+        bonds = np.where(valid, lattice.offsets[sites][:, None] + slots, 0)
+        nbr = np.where(valid, lattice.neighbors[bonds], sites[:, None])
+        coup = np.where(valid, lattice.couplings[bonds], 0.0)
+        tables.append((sites, nbr, coup))
+    return tables
+
+
+def MetropolisSweep(spins: np.array, tables, q: int, beta: float) -> float:
+    """One Metropolis sweep, one vectorized update per sublattice
+
+    Args:
+        spins (np.array): states of all sites, updated in place
+        tables: sublattices (see Sublattices)
+        q (int): number of possible states
+        beta (float): inverse temperature
+
+    Returns:
+        float: energy change of the sweep
+    """
+    change = 0.0
+    for sites, nbr, coup in tables:
+        s = spins[sites]
+        nns = spins[nbr]
+        k = np.random.randint(0, q, size=len(sites))
+        dE = np.sum(coup * ((nns == s[:, None]) * 1.0 - (nns == k[:, None])), axis=1)
+        accept = np.log(np.random.rand(len(sites))) < -beta * dE
+        spins[sites[accept]] = k[accept]
+        change += np.sum(dE[accept])
+    return change
+
+
+def HeatBathSweep(spins: np.array, tables, q: int, beta: float) -> float:
+    """One heat-bath sweep, every site draws its new state from its local Boltzmann distribution
+
+    Args:
+        spins (np.array): states of all sites, updated in place
+        tables: sublattices (see Sublattices)
+        q (int): number of possible states
+        beta (float): inverse temperature
+
+    Returns:
+        float: energy change of the sweep
+    """
+    change = 0.0
+    states = np.arange(q)
+    for sites, nbr, coup in tables:
+        s = spins[sites].astype(np.int64)
+        nns = spins[nbr]
+        # Satisfied couplings of every site for every possible state, E_local = -local
+        local = np.sum(coup[:, :, None] * (nns[:, :, None] == states), axis=1)
+        weights = np.exp(beta * (local - np.max(local, axis=1)[:, None]))
+        cumulative = np.cumsum(weights, axis=1)
+        r = np.random.rand(len(sites)) * cumulative[:, -1]
+        k = np.argmax(cumulative > r[:, None], axis=1)
+        spins[sites] = k
+        rows = np.arange(len(sites))
+        change += np.sum(local[rows, s] - local[rows, k])
+    return change
+
+
+def OrderParameter(spins: np.array, q: int) -> float:
+    """Potts order parameter (q*max_s n_s/N - 1)/(q - 1), |M| for the Ising model (q=2)
+
+    Args:
+        spins (np.array): states of the occupied sites
+        q (int): number of possible states
+
+    Returns:
+        float: order parameter
+    """
+    counts = np.bincount(spins.astype(np.int64), minlength=q)
+    return (q * np.max(counts) / len(spins) - 1.0) / (q - 1.0)
+
+
+def Canonical(
+    lattice: Lattice,
+    T: float,
+    q: int = 2,
+    SWEEPS: int = 10000,
+    THERMALIZATION: int = 1000,
+    METHOD: str = "metropolis",
+    k: float = 1,
+):
+    """Canonical sampling at temperature T
+
+    Args:
+        lattice (Lattice): the grid/lattice object, updated in place
+        T (float): temperature
+        q (int, optional): number of possible states. Defaults to 2.
+        SWEEPS (int, optional): number of measured sweeps. Defaults to 10000.
+        THERMALIZATION (int, optional): sweeps before the first measurement. Defaults to 1000.
+        METHOD (str, optional): "metropolis" or "heatbath". Defaults to "metropolis".
+        k (float, optional): Boltzmann constant. Defaults to 1.
+
+    Returns:
+        (E, M) time series of the energy and the order parameter, one value per sweep
+    """
+    if METHOD == "metropolis":
+        Sweep = MetropolisSweep
+    elif METHOD == "heatbath":
+        Sweep = HeatBathSweep
+    else:
+        raise ValueError(f"Unknown update method: {METHOD}")
+
+    beta = 1.0 / (k * T)
+    tables = Sublattices(lattice)
+    for sweep in range(THERMALIZATION):
+        Sweep(lattice.spins, tables, q, beta)
+
+    energy = lattice.GridEnergy(J=1)
+    E = np.zeros(SWEEPS)
+    M = np.zeros(SWEEPS)
+    for sweep in range(SWEEPS):
+        energy += Sweep(lattice.spins, tables, q, beta)
+        E[sweep] = energy
+        M[sweep] = OrderParameter(lattice.spins[lattice.sites], q)
+    return (E, M)
+
+
+def Autocorrelation(series: np.array) -> np.array:
+    """Normalized autocorrelation function (FFT based)
+
+    Args:
+        series (np.array): time series
+
+    Returns:
+        np.array: rho(t) for t = 0 .. len(series) - 1
+    """
+    n = len(series)
+    x = series - np.mean(series)
+    f = np.fft.rfft(x, 2 * n)
+    acf = np.fft.irfft(f * np.conjugate(f))[:n]
+    if acf[0] == 0:
+        return np.concatenate(([1.0], np.zeros(n - 1)))
+    return acf / acf[0]
+
+
+def IntegratedAutocorrelation(series: np.array, c: float = 5.0) -> float:
+    """Integrated autocorrelation time with automatic windowing (Sokal): the sum over rho(t)
+    is truncated at the smallest window W with W >= c*tau(W)
+
+    Args:
+        series (np.array): time series
+        c (float, optional): window factor. Defaults to 5.
+
+    Returns:
+        float: tau_int in units of the sampling interval (0.5 for uncorrelated data)
+    """
+    rho = Autocorrelation(series)
+    tau = 0.5 + np.cumsum(rho[1:])
+    window = np.arange(1, len(rho))
+    cut = np.flatnonzero(window >= c * tau)
+    return tau[cut[0]] if len(cut) else tau[-1]
+
+
+def CanonicalThermo(E: np.array, T: float, N: int, k: float = 1):
+    """Calculate U and C with errors from an energy time series
+
+    The errors use jackknife blocks that are longer than the autocorrelation time.
+
+    Args:
+        E (np.array): energy time series
+        T (float): temperature
+        N (int): number of lattice sites
+        k (float, optional): Boltzmann constant. Defaults to 1.
+
+    Returns:
+        (U, C, dU, dC) energy and heat capacity per site with their standard errors
+    """
+    tau = IntegratedAutocorrelation(E)
+    blocks = max(2, min(100, int(len(E) / (10 * tau))))
+    E = E[: len(E) // blocks * blocks].reshape(blocks, -1)
+
+    total = np.sum(E, axis=1)
+    total_sq = np.sum(E * E, axis=1)
+    count = E.shape[1] * (blocks - 1)
+    mean = (np.sum(total) - total) / count  # Leave one block out
+    mean_sq = (np.sum(total_sq) - total_sq) / count
+
+    U = mean / N
+    C = (mean_sq - mean**2) / (k * T**2 * N)
+    dU = np.sqrt((blocks - 1) * np.mean((U - np.mean(U)) ** 2))
+    dC = np.sqrt((blocks - 1) * np.mean((C - np.mean(C)) ** 2))
+    return (np.mean(U), np.mean(C), dU, dC)
@@ -0,0 +1,192 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Statistical errors of lng(E) and of the thermodynamic data from independent WLA runs.
+The runs are aligned with the normalization of functions_analysis (symmetric runs are
+mirrored) and the errors are propagated with the jackknife (or the bootstrap),
+vectorized over all temperatures.
+
+"""
+
+import multiprocessing
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from functions_analysis import Normalize, ReconstructSymmetric, ThermoArrays
+from functions_run import DEFAULTS, RunConfiguration
+
+
+def RunReplica(arguments):
+    """Worker: one quiet WLA run, returns (E, lng(E), meta) with E the total energy"""
+    config, seed = arguments
+    REF, LNGE, HIST, META = RunConfiguration(config, seed=seed, QUIET=True)
+    return (REF * META["particles"], LNGE, META)
+
+
+def RunReplicas(config: dict, seeds, processes: int = None):
+    """Runs independent replicas of a configuration in parallel
+
+    Args:
+        config (dict): options (see functions_run.DEFAULTS)
+        seeds (_type_): one seed per replica
+        processes (int, optional): number of worker processes. Defaults to the number of cores.
+
+    Returns:
+        list of (E, lng(E), meta)
+    """
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(RunReplica, [(config, seed) for seed in seeds])
+
+
+def AlignReplicas(runs, Q: int):
+    """Brings all replicas onto their common energies and normalizes them like a single run
+    (Normalize, and ReconstructSymmetric for symmetric runs)
+
+    Args:
+        runs (_type_): list of (E, lng(E), meta)
+        Q (int): number of possible states
+
+    Returns:
+        energies, lng(E) array with one row per replica
+    """
+    common = runs[0][0]
+    for E, lnge, meta in runs[1:]:
+        common = np.intersect1d(common, E)
+
+    rows = []
+    for E, lnge, meta in runs:
+        keep = np.isin(E, common)
+        data = pd.DataFrame({"E": E[keep], "lng(E)": lnge[keep]})
+        energies, normalized = Normalize(data, Q, meta["particles"])
+        if meta["center"] is not None:
+            center = meta["center"] * meta["particles"]
+            energies, normalized = ReconstructSymmetric(energies, normalized, center)
+        rows.append(np.asarray(normalized))
+    return (np.asarray(energies), np.array(rows))
+
+
+def ReplicaThermo(temps, energies, samples, N, k: float = 1):
+    """Thermodynamic data for every row of samples
+
+    Returns:
+        array of shape (4, rows, temperatures) with F, U, C, S
+    """
+    return np.array(
+        [ThermoArrays(temps, energies, lnge, N, k) for lnge in samples]
+    ).transpose(1, 0, 2)
+
+
+def Jackknife(temps, energies, lnge, N, k: float = 1):
+    """Jackknife means and standard errors of lng(E) and of F, U, C, S
+
+    Args:
+        temps (_type_): temperatures
+        energies (_type_): total energies E
+        lnge (_type_): aligned lng(E), one row per replica
+        N (_type_): number of lattice sites
+        k (float, optional): Boltzmann constant. Defaults to 1.
+
+    Returns:
+        (lnge mean, lnge error), (thermo mean, thermo error) with thermo of shape (4, temperatures)
+    """
+    R = len(lnge)
+    samples = (np.sum(lnge, axis=0) - lnge) / (R - 1)  # Leave one replica out
+    thermo = ReplicaThermo(temps, energies, samples, N, k)
+
+    def Errors(values):
+        mean = np.mean(values, axis=0)
+        return np.sqrt((R - 1) / R * np.sum((values - mean) ** 2, axis=0))
+
+    full = np.array(ThermoArrays(temps, energies, np.mean(lnge, axis=0), N, k))
+    return (
+        (np.mean(lnge, axis=0), Errors(samples)),
+        (full, Errors(thermo.transpose(1, 0, 2))),
+    )
+
+
+def Bootstrap(temps, energies, lnge, N, k: float = 1, B: int = 200, seed: int = 0):
+    """Bootstrap means and standard errors of lng(E) and of F, U, C, S (see Jackknife)
+
+    Args:
+        B (int, optional): number of bootstrap samples. Defaults to 200.
+        seed (int, optional): seed of the resampling. Defaults to 0.
+    """
+    R = len(lnge)
+    choice = np.random.default_rng(seed).integers(0, R, size=(B, R))
+    samples = np.mean(lnge[choice], axis=1)
+    thermo = ReplicaThermo(temps, energies, samples, N, k)
+    full = np.array(ThermoArrays(temps, energies, np.mean(lnge, axis=0), N, k))
+    return (
+        (np.mean(lnge, axis=0), np.std(samples, axis=0, ddof=1)),
+        (full, np.std(thermo, axis=1, ddof=1)),
+    )
+
+
+def ReplicaErrors(
+    config: dict,
+    temps,
+    TARGET: float = None,
+    REPLICAS: int = 8,
+    MAX_REPLICAS: int = 64,
+    processes: int = None,
+    METHOD: str = "jackknife",
+    seed: int = 0,
+):
+    """Runs replicas until the largest standard error of C(T) drops below TARGET
+
+    Replicas are started in batches of REPLICAS; without TARGET exactly REPLICAS runs are done.
+    Replicas that did not converge within maxsteps are dropped and reported.
+
+    Args:
+        config (dict): options (see functions_run.DEFAULTS)
+        temps (_type_): temperatures
+        TARGET (float, optional): wanted standard error of C(T)/N. Defaults to None.
+        REPLICAS (int, optional): replicas per batch. Defaults to 8.
+        MAX_REPLICAS (int, optional): upper limit of the number of started replicas. Defaults to 64.
+        processes (int, optional): number of worker processes. Defaults to the number of cores.
+        METHOD (str, optional): "jackknife" or "bootstrap". Defaults to "jackknife".
+        seed (int, optional): seed of the first replica, replica i uses seed + i. Defaults to 0.
+
+    Returns:
+        energies, (lnge mean, lnge error), (thermo mean, thermo error), number of used replicas
+
+    Raises:
+        RuntimeError: if fewer than two replicas converged within MAX_REPLICAS
+    """
+    if METHOD == "jackknife":
+        Estimate = Jackknife
+    elif METHOD == "bootstrap":
+        Estimate = Bootstrap
+    else:
+        raise ValueError(f"Unknown error estimate: {METHOD}")
+
+    Q = {**DEFAULTS, **config}["qstates"]
+    runs = []
+    seeds = []
+    while True:
+        batch = range(seed + len(seeds), seed + len(seeds) + REPLICAS)
+        for replica, run in zip(batch, RunReplicas(config, batch, processes)):
+            if run[2]["converged"]:
+                runs.append(run)
+            else:
+                print(
+                    f"Replica {replica} dropped: not converged (ln(f) = {run[2]['lnf']:.3g})"
+                )
+        seeds += batch
+        if len(runs) < 2:
+            if len(seeds) >= MAX_REPLICAS:
+                raise RuntimeError(
+                    f"Only {len(runs)} of {len(seeds)} replicas converged, increase maxsteps"
+                )
+            continue
+        N = runs[0][2]["particles"]
+        energies, lnge = AlignReplicas(runs, Q)
+        dos, thermo = Estimate(temps, energies, lnge, N)
+        error = np.max(thermo[1][2])
+        print(
+            f"{len(runs)} replicas ({len(seeds) - len(runs)} dropped), "
+            f"largest error of C(T)/N: {error:.5f}"
+        )
+        if TARGET is None or error <= TARGET or len(seeds) >= MAX_REPLICAS:
+            return (energies, dos, thermo, len(runs))
@@ -0,0 +1,192 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Append-only, memory-mapped history of lng(E) snapshots.
+Another process can read the history while the run is going on (no locking needed):
+every record is written completely before its valid flag is set.
+
+"""
+
+import os
+import numpy as np  # type: ignore
+
+STAGE_SNAPSHOT = 1  # Snapshot at the end of a ln(f) stage
+INTERVAL_SNAPSHOT = 0  # Snapshot at a fixed progress interval
+
+
+def HistoryDtype(NBINS: int) -> np.dtype:
+    """Layout of one snapshot record
+
+    Args:
+        NBINS (int): number of energy bins
+
+    Returns:
+        np.dtype: structured record type
+    """
+    return np.dtype(
+        [
+            ("valid", "u1"),
+            ("kind", "u1"),
+            ("iter", "i8"),
+            ("lnf", "f8"),
+            ("lnge", "f8", (NBINS,)),
+            ("hist", "f8", (NBINS,)),
+            ("mask", "?", (NBINS,)),
+        ]
+    )
+
+
+def RefPath(path: str) -> str:
+    """Returns the file that holds the energy bins of a history file"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_ref{ext}"
+
+
+def StopPath(path: str) -> str:
+    """Returns the file whose existence asks the run behind a history file to stop"""
+    return f"{path}.stop"
+
+
+def DonePath(path: str) -> str:
+    """Returns the file whose existence tells readers that the run has ended"""
+    return f"{path}.done"
+
+
+class HistoryWriter:
+    def __init__(
+        self, path: str, ref: np.array, capacity: int = 100, RESERVED: int = 0
+    ):
+        """Preallocates a history file for capacity snapshots
+
+        Args:
+            path (str): history file (.npy)
+            ref (np.array): energy bins
+            capacity (int, optional): maximum number of snapshots. Defaults to 100.
+            RESERVED (int, optional): slots kept for stage snapshots, interval snapshots are
+                dropped first once the history fills up. Defaults to 0.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.reserved = RESERVED
+        self.count = 0
+        self.stages = 0  # Stored stage snapshots
+        self.dropped = set()  # Kinds of snapshots that did not fit
+        np.save(RefPath(path), ref)
+        self.records = np.lib.format.open_memmap(
+            path, mode="w+", dtype=HistoryDtype(len(ref)), shape=(capacity,)
+        )
+        for flag in (StopPath(path), DonePath(path)):
+            if os.path.exists(flag):
+                os.remove(flag)
+
+    def Append(
+        self,
+        kind: int,
+        iter: int,
+        lnf: float,
+        lnge: np.array,
+        hist: np.array,
+        mask: np.array,
+    ) -> bool:
+        """Appends a snapshot. Nothing is flushed, the page cache makes the record visible
+        to readers immediately and the sampler never waits for the disk.
+
+        Returns:
+            bool: False if the history is full and the snapshot was dropped
+        """
+        reserved = 0 if kind == STAGE_SNAPSHOT else max(self.reserved - self.stages, 0)
+        if self.count + reserved >= self.capacity:
+            if kind not in self.dropped:
+                name = "stage" if kind == STAGE_SNAPSHOT else "interval"
+                print(f"History is full, no further {name} snapshots are stored.")
+                self.dropped.add(kind)
+            return False
+        record = self.records[self.count]
+        record["kind"] = kind
+        record["iter"] = iter
+        record["lnf"] = lnf
+        record["lnge"] = lnge
+        record["hist"] = hist
+        record["mask"] = mask
+        record["valid"] = 1  # Set last, readers skip incomplete records
+        self.count += 1
+        if kind == STAGE_SNAPSHOT:
+            self.stages += 1
+        return True
+
+    def StopRequested(self) -> bool:
+        """Returns True if a reader asked the run to stop (see RequestStop)"""
+        return os.path.exists(StopPath(self.path))
+
+    def Close(self):
+        """Flushes the history and marks the run as ended (see HistoryFinished)"""
+        self.records.flush()
+        del self.records
+        open(DonePath(self.path), "w").close()
+
+
+def ReadHistory(path: str):
+    """Reads all complete snapshots of a (possibly still running) history file
+
+    Args:
+        path (str): history file (.npy)
+
+    Returns:
+        energy bins, snapshot records
+    """
+    ref = np.load(RefPath(path))
+    records = np.load(path, mmap_mode="r")
+    n = np.argmin(records["valid"]) if not np.all(records["valid"]) else len(records)
+    return (ref, np.array(records[:n]))
+
+
+def SnapshotDifference(a, b) -> float:
+    """Largest difference of two lng(E) snapshots on their common bins.
+    Both are shifted to zero at the first common bin, since lng(E) is only defined up to a constant.
+
+    Args:
+        a: snapshot record
+        b: snapshot record
+
+    Returns:
+        float: max |lng_a(E) - lng_b(E)|
+    """
+    mask = a["mask"] & b["mask"]
+    if not np.any(mask):
+        return np.inf
+    x = a["lnge"][mask] - a["lnge"][mask][0]
+    y = b["lnge"][mask] - b["lnge"][mask][0]
+    return np.max(np.abs(x - y))
+
+
+def HistoryConverged(path: str, TOLERANCE: float) -> bool:
+    """Checks whether the last two ln(f) stages of a history file agree within TOLERANCE
+
+    Args:
+        path (str): history file (.npy)
+        TOLERANCE (float): maximal difference of lng(E)
+
+    Returns:
+        bool: True if converged
+    """
+    ref, records = ReadHistory(path)
+    stages = records[records["kind"] == STAGE_SNAPSHOT]
+    if len(stages) < 2:
+        return False
+    return SnapshotDifference(stages[-2], stages[-1]) < TOLERANCE
+
+
+def HistoryFinished(path: str) -> bool:
+    """Returns True once the run that writes the history file has ended (converged or not)"""
+    return os.path.exists(DonePath(path))
+
+
+def RequestStop(path: str):
+    """Asks the run that writes the history file to stop after its current ln(f) stage
+
+    Args:
+        path (str): history file (.npy)
+    """
+    open(StopPath(path), "w").close()
@@ -0,0 +1,362 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Bit-packed Ising (Q=2) lattice: one bit per spin, 64 spins per word (multi-spin coding).
+Aligned bonds are counted with XOR and popcount, both for the lattice energy and for local changes.
+
+"""
+
+import numpy as np  # type: ignore
+from numba import jit  # type: ignore
+from functions import BMAX, GetDeltaIndex, HistogramFlat
+from functions_profile import ReadCycles
+from functions_profile import (
+    PROPOSAL_PHASE,
+    ENERGY_PHASE,
+    BINNING_PHASE,
+    FLATNESS_PHASE,
+)
+
+ONE = np.uint64(1)
+
+
+class PackedIsingLattice:
+    """
+    Periodic square lattice with two states per site. Bit j of row i is stored in
+    words[i, j // 64] at position j % 64, bits beyond the row length are zero.
+    Drop-in replacement for Lattice in WangLandau for Q=2.
+    """
+
+    def __init__(self, size: int = 10):
+        self.size = size
+        self.shape = (size, size)
+        self.particles = size**2
+        self.words = np.zeros((size, (size + 63) // 64), dtype=np.uint64)
+
+    @property
+    def grid(self):
+        """
+        Unpacked copy of the spins in the shape of the lattice
+        """
+        bits = np.unpackbits(self.words.view(np.uint8), axis=1, bitorder="little")
+        return bits[:, : self.size].astype(np.float64)
+
+    @grid.setter
+    def grid(self, value):
+        bits = np.zeros((self.size, self.words.shape[1] * 64), dtype=np.uint8)
+        bits[:, : self.size] = np.asarray(value) != 0
+        packed = np.packbits(bits, axis=1, bitorder="little")
+        self.words = np.ascontiguousarray(packed).view(np.uint64).copy()
+
+    def EnergyBounds(self):
+        """
+        Returns the lowest and the highest energy of the lattice
+        """
+        return (-2.0 * self.particles, 0.0)
+
+    def EnergySpacing(self, q: int = 2) -> float:
+        """
+        Returns the spacing of the possible energies (the number of broken bonds is always even)
+        """
+        return 2.0
+
+    def IsBipartite(self) -> bool:
+        """
+        The periodic square lattice is bipartite for even sizes
+        """
+        return self.size % 2 == 0
+
+    def Randomize(self, q: int = 2):
+        """
+        Assigns every lattice point a random state out of [0, 2)
+        """
+        if q != 2:
+            raise ValueError("The packed lattice only supports Q=2")
+        self.words = np.random.randint(
+            0, np.iinfo(np.uint64).max, size=self.words.shape, dtype=np.uint64
+        )
+        self.words[:, -1] &= RowMask(self.size)
+
+    def PrepareEnergy(
+        self, q: int, LB: float, UB: float, J: float = 1.0, max_steps: int = 10e8
+    ) -> float:
+        """
+        Walks the current configuration into the energy window [LB, UB] and returns its energy
+        """
+        energy = PackedWalkToEnergy(self.words, self.size, LB, UB, J, int(max_steps))
+        if energy < LB or energy > UB:
+            raise RuntimeError(
+                f"Could not reach the energy window [{LB}, {UB}] (last energy: {energy})"
+            )
+        return energy
+
+    def GridEnergy(self, J):
+        return PackedEnergy(self.words, self.size, J)
+
+    def WangLandauSteps(
+        self,
+        q,
+        ref,
+        lnge,
+        groups,
+        hist,
+        mask,
+        lnf,
+        energy,
+        LB,
+        UB,
+        nsteps,
+        check,
+        FLATNESS,
+        counters,
+    ):
+        """
+        Performs up to nsteps Wang Landau steps in place, see PackedWangLandauKernel
+        """
+        return PackedWangLandauKernel(
+            self.words,
+            self.size,
+            ref,
+            lnge,
+            groups,
+            hist,
+            mask,
+            lnf,
+            energy,
+            LB,
+            UB,
+            nsteps,
+            check,
+            FLATNESS,
+            counters,
+        )
+
+    def GetMag(self):
+        """
+        Returns the overall magnezization M of the lattice
+        States 0 and 1 are mapped onto the spins -1 and +1
+        """
+        return 2.0 * CountBits(self.words) / self.particles - 1.0
+
+
+"""
+Functions
+"""
+
+
+def RowMask(size: int) -> np.uint64:
+    """Mask of the valid bits in the last word of a row"""
+    bits = size % 64
+    return (
+        np.uint64(0xFFFFFFFFFFFFFFFF) if bits == 0 else (ONE << np.uint64(bits)) - ONE
+    )
+
+
+@jit(nopython=True)
+def PopCount(x: np.uint64) -> int:
+    """Number of set bits in a 64-bit word (SWAR)"""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + (
+        (x >> np.uint64(2)) & np.uint64(0x3333333333333333)
+    )
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return int((x * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+
+@jit(nopython=True)
+def CountBits(words: np.array) -> int:
+    """Number of set bits (spins in state 1) of a packed lattice"""
+    count = 0
+    for i in range(words.shape[0]):
+        for w in range(words.shape[1]):
+            count += PopCount(words[i, w])
+    return count
+
+
+@jit(nopython=True)
+def GetBit(words: np.array, i: int, j: int) -> np.uint64:
+    return (words[i, j >> 6] >> np.uint64(j & 63)) & np.uint64(1)
+
+
+@jit(nopython=True)
+def FlipBit(words: np.array, i: int, j: int):
+    words[i, j >> 6] ^= np.uint64(1) << np.uint64(j & 63)
+
+
+@jit(nopython=True)
+def PackedEnergy(words: np.array, size: int, J: float = 1.0) -> float:
+    """Lattice energy E = -J * (number of aligned bonds) from XOR and popcount
+
+    Args:
+        words (np.array): packed lattice
+        size (int): lattice size
+        J (float): coupling constant. Defaults to 1.
+
+    Returns:
+        float: lattice energy
+    """
+    W = words.shape[1]
+    last = (size - 1) >> 6
+    shift = np.uint64((size - 1) & 63)
+    rotated = np.zeros(W, dtype=np.uint64)
+    broken = 0
+    for i in range(size):
+        row = words[i]
+        below = words[(i + 1) % size]
+        # rotated bit j = row bit (j + 1) % size (right neighbor)
+        for w in range(W):
+            rotated[w] = row[w] >> np.uint64(1)
+            if w + 1 < W:
+                rotated[w] |= row[w + 1] << np.uint64(63)
+        rotated[last] |= (row[0] & np.uint64(1)) << shift
+        for w in range(W):
+            broken += PopCount(row[w] ^ below[w]) + PopCount(row[w] ^ rotated[w])
+    return -J * float(2 * size * size - broken)
+
+
+@jit(nopython=True)
+def PackedDeltaEnergy(words: np.array, size: int, i: int, j: int, J: float = 1.0):
+    """Energy change of flipping site (i, j): the four neighbor bits are gathered into one
+    nibble and compared with the spin by XOR and popcount
+
+    Args:
+        words (np.array): packed lattice
+        size (int): lattice size
+        i (int): i dimension
+        j (int): j dimension
+        J (float): coupling constant. Defaults to 1.
+
+    Returns:
+        float: E(flipped) - E(current)
+    """
+    nibble = (
+        GetBit(words, (i + 1) % size, j)
+        | (GetBit(words, (i - 1) % size, j) << np.uint64(1))
+        | (GetBit(words, i, (j + 1) % size) << np.uint64(2))
+        | (GetBit(words, i, (j - 1) % size) << np.uint64(3))
+    )
+    broken = PopCount(nibble ^ (GetBit(words, i, j) * np.uint64(15)))
+    return J * (4 - 2 * broken)
+
+
+@jit(nopython=True)
+def PackedWalkToEnergy(
+    words: np.array, size: int, LB: float, UB: float, J: float, max_steps: int
+) -> float:
+    """Moves a packed lattice in place into the energy window [LB, UB], see WalkToEnergy
+    (the high energy state is the checkerboard)
+
+    Args:
+        words (np.array): packed lattice
+        size (int): lattice size
+        LB (float): lower energy bound
+        UB (float): upper energy bound
+        J (float): coupling constant
+        max_steps (int): maximum number of proposed flips
+
+    Returns:
+        float: energy of the final configuration
+    """
+    target = 0.5 * (LB + UB)
+    energy = PackedEnergy(words, size, J)
+    if energy > UB:
+        words[:, :] = 0
+        energy = PackedEnergy(words, size, J)
+    elif energy < LB:
+        words[:, :] = 0
+        for i in range(size):
+            for j in range((i + 1) % 2, size, 2):
+                FlipBit(words, i, j)
+        energy = PackedEnergy(words, size, J)
+    for step in range(max_steps):
+        if energy >= LB and energy <= UB:
+            break
+        i = np.random.randint(0, size)
+        j = np.random.randint(0, size)
+        delta = PackedDeltaEnergy(words, size, i, j, J)
+        d = abs(energy + delta - target) - abs(energy - target)
+        b = min(1.0 + step / (size * size), BMAX)
+        if d <= 0.0 or np.random.rand() < np.exp(-b * d):
+            FlipBit(words, i, j)
+            energy += delta
+    return energy
+
+
+@jit(nopython=True)
+def PackedWangLandauKernel(
+    words: np.array,
+    size: int,
+    ref: np.array,
+    lnge: np.array,
+    groups: np.array,
+    hist: np.array,
+    mask: np.array,
+    lnf: float,
+    energy: float,
+    LB: float,
+    UB: float,
+    nsteps: int,
+    check: int,
+    FLATNESS: float,
+    counters: np.array,
+):
+    """Compiled Wang Landau steps on a packed lattice, same moves as WangLandauKernel for Q=2
+    (a random site gets a random state, which is its current state half of the time)
+    counters receives the cycles per phase if it is not empty, see functions_profile
+
+    Returns:
+        energy of the final configuration, number of performed steps, True if the histogram is flat
+    """
+    profile = len(counters) > 0
+    start = 0
+    index_eold = GetDeltaIndex(ref, energy)
+    for iter in range(nsteps):
+        EnergyCheck = False
+        while not EnergyCheck:
+            if profile:
+                start = ReadCycles()
+            i = np.random.randint(0, size)
+            j = np.random.randint(0, size)
+            flip = np.random.randint(0, 2) == 1
+            if profile:
+                now = ReadCycles()
+                counters[PROPOSAL_PHASE] += now - start
+                start = now
+            enew = energy
+            if flip:
+                enew += PackedDeltaEnergy(words, size, i, j, 1.0)
+            if profile:
+                now = ReadCycles()
+                counters[ENERGY_PHASE] += now - start
+                start = now
+            if enew <= UB and enew >= LB:
+                EnergyCheck = True
+
+        index_enew = GetDeltaIndex(ref, enew)
+
+        dos_ratio = np.exp(lnge[index_eold] - lnge[index_enew])  # Difference in DOS
+
+        if dos_ratio >= 1.0 or np.random.rand() < dos_ratio:  # WLA Criterion
+            if flip:
+                FlipBit(words, i, j)
+            energy = enew
+            index_eold = index_enew
+
+        hist[groups[index_eold]] += 1
+        lnge[index_eold] += lnf
+
+        if profile:
+            now = ReadCycles()
+            counters[BINNING_PHASE] += now - start
+            start = now
+
+        if iter % check == 0:
+            flat = HistogramFlat(hist, mask, FLATNESS)
+            if profile:
+                counters[FLATNESS_PHASE] += ReadCycles() - start
+            if flat:
+                return (energy, iter + 1, True)
+
+    return (energy, nsteps, False)
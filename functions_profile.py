@@ -0,0 +1,122 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Profiling mode (--profile): the compiled kernels read the CPU cycle counter (llvm.readcyclecounter)
+around each phase of a Wang Landau step, the Python side of WangLandau is timed with perf_counter.
+The cycle counts are converted to seconds with the counter rate measured over the whole run.
+
+"""
+
+import contextlib
+import os
+import time
+import numpy as np  # type: ignore
+from llvmlite import ir  # type: ignore
+from numba import jit, types  # type: ignore
+from numba.core import cgutils  # type: ignore
+from numba.extending import intrinsic  # type: ignore
+
+# Phases inside the compiled kernels (indices into the counters array)
+PROPOSAL_PHASE = 0  # random site and state, including redraws outside [LB, UB]
+ENERGY_PHASE = 1  # energy change of the proposal
+BINNING_PHASE = 2  # energy bin, acceptance and the lnge/histogram update
+FLATNESS_PHASE = 3  # flatness criterion
+KERNEL_PHASES = ("proposal", "energy", "binning", "flatness")
+
+
+@intrinsic
+def _ReadCycleCounter(typingctx):
+    def codegen(context, builder, signature, args):
+        function = cgutils.get_or_insert_function(
+            builder.module, ir.FunctionType(ir.IntType(64), []), "llvm.readcyclecounter"
+        )
+        return builder.call(function, [])
+
+    return types.int64(), codegen
+
+
+@jit(nopython=True)
+def ReadCycles() -> int:
+    """Current value of the CPU cycle counter (0 on platforms without one)"""
+    return _ReadCycleCounter()
+
+
+class Profiler:
+    def __init__(self, enabled: bool = True):
+        """Collects the time spent in the phases of a run
+
+        Args:
+            enabled (bool, optional): False gives an empty counters array, which switches
+                the counting off in the kernels. Defaults to True.
+        """
+        self.enabled = enabled
+        self.counters = np.zeros(len(KERNEL_PHASES) if enabled else 0, dtype=np.int64)
+        self.seconds = {}
+        if enabled:
+            ReadCycles()  # Compile before the calibration starts
+            self.start = (time.perf_counter(), ReadCycles())
+
+    @contextlib.contextmanager
+    def Phase(self, name: str):
+        """Adds the wall time of the with block to the phase name"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = (
+                self.seconds.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def Breakdown(self) -> dict:
+        """Returns the seconds per phase. kernel/other is the part of the kernel calls that is not
+        covered by the counters (loop overhead and the compilation of the kernels)
+        """
+        total = time.perf_counter() - self.start[0]
+        rate = (ReadCycles() - self.start[1]) / total  # Cycles per second
+        kernel = self.seconds.get("kernel", 0.0)
+
+        breakdown = {}
+        if rate > 0:
+            for name, cycles in zip(KERNEL_PHASES, self.counters):
+                breakdown[f"kernel/{name}"] = cycles / rate
+        breakdown["kernel/other"] = kernel - sum(breakdown.values())
+        for name, seconds in self.seconds.items():
+            if name != "kernel":
+                breakdown[name] = seconds
+        breakdown["other"] = total - sum(self.seconds.values())
+        return breakdown
+
+    def Report(self) -> str:
+        """Per-phase table, sorted by time"""
+        breakdown = self.Breakdown()
+        total = sum(breakdown.values())
+        lines = [f"{'phase':<20}{'seconds':>12}{'share':>10}"]
+        for name, seconds in sorted(breakdown.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:<20}{seconds:>12.4f}{100 * seconds / total:>9.1f}%")
+        lines.append(f"{'total':<20}{total:>12.4f}")
+        return "\n".join(lines)
+
+    def Folded(self, root: str = "main") -> str:
+        """Folded stacks in microseconds (input of flamegraph.pl, speedscope, inferno)"""
+        lines = []
+        for name, seconds in self.Breakdown().items():
+            stack = ";".join([root, "WangLandau", *name.split("/")])
+            if name in ("setup", "other"):
+                stack = f"{root};{name}"
+            lines.append(f"{stack} {max(int(round(seconds * 1e6)), 0)}")
+        return "\n".join(lines) + "\n"
+
+    def Save(self, directory: str):
+        """Writes profile.txt and profile.folded into directory"""
+        with open(os.path.join(directory, "profile.txt"), "w") as f:
+            f.write(self.Report() + "\n")
+        with open(os.path.join(directory, "profile.folded"), "w") as f:
+            f.write(self.Folded())
+
+
+NO_PROFILE = Profiler(enabled=False)
@@ -0,0 +1,152 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Streaming reweighting of lng(E): the energies are processed in chunks and the temperatures in blocks,
+so the memory does not grow with the number of energies or temperatures (only the results do).
+Every chunk is reduced with log-sum-exp and merged into running values of ln Z, <E> and Var(E),
+which also allows stacking the energies of many runs or of a joint g(E, M).
+
+"""
+
+import numpy as np
+
+CHUNK = 16384  # Energies per chunk
+TBLOCK = 64  # Temperatures per block
+
+
+def ArrayChunks(energies, lnge, CHUNK: int = CHUNK):
+    """Splits energy and lng(E) arrays (e.g. np.memmap) into chunks
+
+    Args:
+        energies (_type_): total energies E
+        lnge (_type_): lng(E)
+        CHUNK (int, optional): energies per chunk. Defaults to CHUNK.
+
+    Returns:
+        callable that returns a new iterator over (E, lng(E)) chunks
+    """
+
+    def Source():
+        for start in range(0, len(energies), CHUNK):
+            yield (energies[start : start + CHUNK], lnge[start : start + CHUNK])
+
+    return Source
+
+
+class ReweightAccumulator:
+    def __init__(self, temps, k: float = 1):
+        """Running ln Z, <E> and Var(E) for a block of temperatures
+
+        Args:
+            temps (_type_): temperatures
+            k (float, optional): Boltzmann constant. Defaults to 1.
+        """
+        self.beta = 1.0 / (k * np.asarray(temps, dtype=np.float64))
+        self.lnZ = np.full(len(self.beta), -np.inf)
+        self.peak = np.full(len(self.beta), -np.inf)  # Largest exponent lng(E) - E/kT
+        self.mean = np.zeros(len(self.beta))
+        self.var = np.zeros(len(self.beta))
+
+    def Add(self, energies, lnge):
+        """Merges a chunk of energies (parallel variance formula with log-weights)
+
+        Args:
+            energies (_type_): total energies E
+            lnge (_type_): lng(E)
+        """
+        energies = np.asarray(energies, dtype=np.float64)
+        if len(energies) == 0:
+            return
+        exponents = (
+            np.asarray(lnge, dtype=np.float64)[None, :]
+            - self.beta[:, None] * energies[None, :]
+        )
+        maxval = np.max(exponents, axis=1)
+        weights = np.exp(exponents - maxval[:, None])
+        sigma = np.sum(weights, axis=1)
+        mean = weights @ energies / sigma
+        var = np.sum(weights * (energies[None, :] - mean[:, None]) ** 2, axis=1) / sigma
+
+        lnZ = np.logaddexp(self.lnZ, maxval + np.log(sigma))
+        a = np.exp(self.lnZ - lnZ)  # Weight of the previous chunks
+        b = np.exp(maxval + np.log(sigma) - lnZ)  # Weight of this chunk
+        delta = mean - self.mean
+        self.mean = self.mean + b * delta
+        self.var = a * self.var + b * var + a * b * delta**2
+        self.lnZ = lnZ
+        self.peak = np.maximum(self.peak, maxval)
+
+
+def StreamMoments(temps, source, k: float = 1, TBLOCK: int = TBLOCK):
+    """ln Z, <E> and Var(E) for many temperatures, one temperature block at a time
+
+    Args:
+        temps (_type_): temperatures
+        source (callable): returns an iterator over (E, lng(E)) chunks, see ArrayChunks
+        k (float, optional): Boltzmann constant. Defaults to 1.
+        TBLOCK (int, optional): temperatures per block. Defaults to TBLOCK.
+
+    Returns:
+        _type_: (lnZ, mean, var) arrays with one value per temperature
+    """
+    temps = np.asarray(temps, dtype=np.float64)
+    lnZ = np.zeros(len(temps))
+    mean = np.zeros(len(temps))
+    var = np.zeros(len(temps))
+    for start in range(0, len(temps), TBLOCK):
+        block = slice(start, start + TBLOCK)
+        accumulator = ReweightAccumulator(temps[block], k)
+        for energies, lnge in source():
+            accumulator.Add(energies, lnge)
+        lnZ[block] = accumulator.lnZ
+        mean[block] = accumulator.mean
+        var[block] = accumulator.var
+    return (lnZ, mean, var)
+
+
+def StreamThermo(temps, source, N, k: float = 1, TBLOCK: int = TBLOCK):
+    """Calculate thermodynamic data for many temperatures in constant memory
+
+    Args:
+        temps (_type_): temperatures
+        source (callable): returns an iterator over (E, lng(E)) chunks, see ArrayChunks
+        N (_type_): number of lattice sites
+        k (float, optional): Boltzmann constant. Defaults to 1.
+        TBLOCK (int, optional): temperatures per block. Defaults to TBLOCK.
+
+    Returns:
+        _type_: (F,U,C,S) arrays with one value per temperature
+    """
+    T = np.asarray(temps, dtype=np.float64)
+    lnZ, mean, var = StreamMoments(T, source, k, TBLOCK)
+
+    F = -k * T * lnZ / N
+    U = mean / N
+    C = var / (k * T**2 * N)
+    S = (U - F) / T
+
+    return (F, U, C, S)
+
+
+def StreamDistribution(T: float, source, k: float = 1, PEAK: bool = False):
+    """Boltzmann distribution g(E)exp(-E/kT) at one temperature, chunk by chunk (two passes)
+
+    Args:
+        T (float): temperature
+        source (callable): returns an iterator over (E, lng(E)) chunks, see ArrayChunks
+        k (float, optional): Boltzmann constant. Defaults to 1.
+        PEAK (bool, optional): scale the maximum to 1 instead of the sum. Defaults to False.
+
+    Yields:
+        (E, P(E)) chunks
+    """
+    accumulator = ReweightAccumulator([T], k)
+    for energies, lnge in source():
+        accumulator.Add(energies, lnge)
+    shift = accumulator.peak[0] if PEAK else accumulator.lnZ[0]
+
+    for energies, lnge in source():
+        energies = np.asarray(energies, dtype=np.float64)
+        yield (energies, np.exp(np.asarray(lnge) - energies / (k * T) - shift))
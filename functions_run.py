@@ -0,0 +1,198 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Set up and run a complete WLA simulation from a configuration dictionary
+(the same keys as the command line options of main.py).
+
+"""
+
+import contextlib
+import io
+import json
+import numpy as np  # type: ignore
+from functions import EnergyLevels, Lattice, Seed, WangLandau, WangLandauRefined
+from functions_analysis import MetaPath
+from functions_history import HistoryWriter
+from functions_ising import PackedIsingLattice
+from functions_profile import NO_PROFILE
+
+DEFAULTS = {
+    "gridsize": 10,
+    "flatness": 0.8,
+    "finallnf": 0.000001,
+    "bins": 100,
+    "qstates": 2,
+    "geometry": "square",
+    "dilution": 0.0,
+    "dense": False,
+    "symmetric": False,
+    "refine": False,
+    "coarsebins": 32,
+    "maxsteps": 1e6,
+}
+
+
+def MakeLattice(
+    L: int, Q: int, GEOMETRY: str = "square", DILUTION: float = 0.0, DENSE=False
+):
+    """Returns the bit-packed lattice for the Ising model on the square lattice, Lattice otherwise
+
+    Args:
+        L (int): lattice size
+        Q (int): number of possible states
+        GEOMETRY (str, optional): lattice geometry. Defaults to "square".
+        DILUTION (float, optional): fraction of empty sites. Defaults to 0.0.
+        DENSE (bool, optional): never use the packed lattice. Defaults to False.
+    """
+    if Q == 2 and GEOMETRY == "square" and DILUTION == 0 and not DENSE:
+        return PackedIsingLattice(L)  # One bit per spin
+    return Lattice(L, GEOMETRY, DILUTION)
+
+
+def RunConfiguration(
+    config: dict,
+    seed: int = None,
+    HISTORY_PATH: str = None,
+    SNAPSHOTS: int = 0,
+    TOLERANCE: float = 0.0,
+    QUIET: bool = False,
+    PROGRESS=None,
+    PROFILE=None,
+):
+    """Runs the WLA for one configuration
+
+    Args:
+        config (dict): options, missing keys are taken from DEFAULTS
+        seed (int, optional): seed of all random number generators. Defaults to None.
+        HISTORY_PATH (str, optional): stream lng(E) snapshots to this file. Defaults to None.
+        SNAPSHOTS (int, optional): extra snapshot every n printing intervals. Defaults to 0.
+        TOLERANCE (float, optional): stop once successive ln(f) stages agree. Defaults to 0.0.
+        QUIET (bool, optional): suppress the progress output. Defaults to False.
+        PROGRESS (callable, optional): progress callback, see WangLandau. Defaults to None.
+        PROFILE (Profiler, optional): collects the time per phase, see functions_profile. Defaults to None.
+
+    Returns:
+        energy bins ref/N, lnge, last histogram and the run metadata (config, number of
+        lattice sites "particles", the symmetry center "center" in units of E/N or None, the
+        reached "lnf" and "converged", False if a stage did not converge within maxsteps)
+    """
+    config = {**DEFAULTS, **config}
+    profile = NO_PROFILE if PROFILE is None else PROFILE
+    if seed is not None:
+        Seed(seed)
+
+    out = io.StringIO() if QUIET else None
+    with contextlib.redirect_stdout(out) if QUIET else contextlib.nullcontext():
+        L = config["gridsize"]
+        N = config["bins"]
+        Q = config["qstates"]
+        FINAL_LNF = config["finallnf"]
+
+        with profile.Phase("setup"):
+            x = MakeLattice(
+                L, Q, config["geometry"], config["dilution"], config["dense"]
+            )
+        LB, UB = x.EnergyBounds()  # Derived from the bonds of the lattice
+
+        center = None
+        if config["symmetric"]:
+            # Q=2 on a bipartite lattice: flipping one sublattice maps E to LB + UB - E
+            if Q != 2 or not x.IsBipartite():
+                raise ValueError(
+                    "Symmetric sampling needs Q=2 on a bipartite lattice "
+                    f"(Q={Q}, geometry={config['geometry']}, size={L})"
+                )
+            center = 0.5 * (LB + UB)
+            UB = center  # Only the irreducible half of the energy range is sampled
+            print("Sampling the irreducible energy range up to", UB)
+
+        if config["refine"]:
+            STEP = x.EnergySpacing(Q)
+            if STEP is None:
+                raise ValueError("Bin refinement needs integer couplings")
+            ref = EnergyLevels(LB, UB, STEP)  # One bin per energy level at the end
+            N = len(ref)
+        else:
+            ref = np.linspace(LB, UB, N)  # Setting up energy bins
+        print("Number of Bins:", N)
+
+        with profile.Phase("setup"):
+            x.Randomize(Q)
+            initial_energy = x.PrepareEnergy(Q, LB, UB)
+
+        print("Found initial lattice. Energy: ", initial_energy)
+
+        INTERVAL = 100  # Progress print every INTERVAL sweeps
+        history = None
+        if HISTORY_PATH is not None:
+            stages = int(np.ceil(np.log2(1.0 / FINAL_LNF))) + 2
+            intervals = 0  # Interval snapshots of the longest possible stage
+            if SNAPSHOTS > 0:
+                sweeps = config["maxsteps"] / (x.particles * INTERVAL * SNAPSHOTS)
+                intervals = int(np.ceil(sweeps))
+            # Stage snapshots always get their slots, interval snapshots are dropped first
+            history = HistoryWriter(
+                HISTORY_PATH,
+                ref,
+                capacity=stages * (1 + intervals),
+                RESERVED=stages,
+            )
+
+        options = dict(
+            INTERVAL=INTERVAL,
+            FLATNESS=config["flatness"],
+            CONTROLF=FINAL_LNF,
+            q=Q,
+            HISTORY=history,
+            SNAPSHOTS=SNAPSHOTS,
+            TOLERANCE=TOLERANCE,
+            PROGRESS=PROGRESS,
+            PROFILE=PROFILE,
+        )
+        try:
+            if config["refine"]:
+                REF, LNGE_A, HIST_A, lnf = WangLandauRefined(
+                    x,
+                    LB,
+                    UB,
+                    STEP=STEP,
+                    COARSE_BINS=config["coarsebins"],
+                    MAX_STEPS=config["maxsteps"],
+                    **options,
+                )
+            else:
+                REF, LNGE_A, HIST_A, lnf = WangLandau(
+                    x,
+                    ref,
+                    config["maxsteps"],
+                    NBINS=N,
+                    L=L,
+                    LB=LB,
+                    UB=UB,
+                    **options,
+                )
+        finally:
+            if history is not None:
+                history.Close()  # Also tells readers that the run has ended
+
+    META = {
+        **config,
+        "particles": x.particles,
+        "center": None if center is None else center / x.particles,
+        "lnf": lnf,  # Reached ln(f)
+        "converged": bool(lnf <= FINAL_LNF),
+    }
+    return (REF, LNGE_A, HIST_A, META)
+
+
+def SaveMeta(path: str, META: dict):
+    """Writes the run metadata next to a result file
+
+    Args:
+        path (str): result file (out_final.txt)
+        META (dict): run metadata (see RunConfiguration)
+    """
+    with open(MetaPath(path), "w") as f:
+        json.dump(META, f, indent=2)
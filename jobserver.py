@@ -0,0 +1,353 @@
+"""
+
+MLO @ Princeton 2024
+MC Simulation for Q-State Potts Model with Wang Landau Algorithm
+
+Local job server: a durable SQLite queue of WLA runs, a worker pool with a fixed
+concurrency limit and a small HTTP/CLI interface for submitting and monitoring jobs.
+Identical requests (same configuration and seed) return the cached result, runs that did not
+converge within maxsteps are kept as "unconverged" and queued again like failed ones.
+
+python jobserver.py serve -w 4 -p 8765
+python jobserver.py submit gridsize=16 qstates=2 finallnf=1e-6 -s 1
+python jobserver.py status 3
+python jobserver.py list
+
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd  # type: ignore
+from functions_run import DEFAULTS, RunConfiguration, SaveMeta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE NOT NULL,
+    config TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    lnf REAL,
+    iter INTEGER,
+    flatness REAL,
+    result TEXT,
+    error TEXT,
+    submitted REAL,
+    started REAL,
+    finished REAL
+)
+"""
+
+COLUMNS = [
+    "id",
+    "key",
+    "config",
+    "seed",
+    "status",
+    "lnf",
+    "iter",
+    "flatness",
+    "result",
+    "error",
+    "submitted",
+    "started",
+    "finished",
+]
+
+
+def Connect(database: str) -> sqlite3.Connection:
+    """Opens the job database (created on first use)"""
+    connection = sqlite3.connect(database, timeout=60, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(SCHEMA)
+    return connection
+
+
+def NormalizeConfig(config: dict) -> dict:
+    """Checks the keys and value types of a configuration and casts the values to the types
+    of DEFAULTS (e.g. 16.0 -> 16 for the gridsize, 1 -> 1.0 for the flatness)
+
+    Args:
+        config (dict): options (see functions_run.DEFAULTS)
+
+    Returns:
+        dict: normalized options
+    """
+    if not isinstance(config, dict):
+        raise ValueError("The configuration must be a JSON object")
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown configuration keys: {sorted(unknown)}")
+
+    normalized = {}
+    for key, value in config.items():
+        kind = type(DEFAULTS[key])
+        if kind is bool:
+            valid = isinstance(value, bool)
+        elif kind is int:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+            valid = valid and float(value).is_integer()
+        elif kind is float:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, kind)
+        if not valid:
+            raise ValueError(f"{key} must be of type {kind.__name__}, not {value!r}")
+        normalized[key] = kind(value)
+    return normalized
+
+
+def JobKey(config: dict, seed: int) -> str:
+    """Hash of the normalized configuration and the seed. Options equal to their default are
+    left out, so {} and {"gridsize": 10} give the same key and adding a new option to DEFAULTS
+    keeps the keys of the cached results.
+    """
+    config = {
+        key: value
+        for key, value in NormalizeConfig(config).items()
+        if value != DEFAULTS[key]
+    }
+    text = json.dumps({"config": config, "seed": seed}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def AsDict(row) -> dict:
+    job = dict(zip(COLUMNS, row))
+    job["config"] = json.loads(job["config"])
+    return job
+
+
+def Submit(database: str, config: dict, seed: int = None) -> dict:
+    """Queues a run. Returns the existing job if the same configuration and seed was
+    submitted before (failed and unconverged jobs are queued again).
+
+    Args:
+        database (str): job database
+        config (dict): options (see functions_run.DEFAULTS)
+        seed (int, optional): seed, random if None. Defaults to None.
+
+    Returns:
+        dict: the job
+    """
+    config = NormalizeConfig(config)
+    if seed is None:
+        seed = random.randrange(2**31)
+    if not isinstance(seed, int) or isinstance(seed, bool):
+        raise ValueError(f"The seed must be an integer, not {seed!r}")
+    key = JobKey(config, seed)
+
+    connection = Connect(database)
+    with connection:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute(
+            "SELECT status FROM jobs WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            connection.execute(
+                "INSERT INTO jobs (key, config, seed, status, submitted) "
+                "VALUES (?, ?, ?, 'queued', ?)",
+                (key, json.dumps({**DEFAULTS, **config}), seed, time.time()),
+            )
+        elif row[0] in ("failed", "unconverged"):
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL WHERE key = ?",
+                (key,),
+            )
+    row = connection.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+    connection.close()
+    return AsDict(row)
+
+
+def Status(database: str, job: int = None):
+    """Returns one job (by id) or all jobs"""
+    connection = Connect(database)
+    if job is None:
+        rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        connection.close()
+        return [AsDict(row) for row in rows]
+    row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job,)).fetchone()
+    connection.close()
+    return None if row is None else AsDict(row)
+
+
+def Claim(connection: sqlite3.Connection):
+    """Marks the oldest queued job as running and returns it (None if the queue is empty)"""
+    with connection:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            "UPDATE jobs SET status = 'running', started = ? WHERE id = ?",
+            (time.time(), row[0]),
+        )
+    return AsDict(row)
+
+
+def Worker(database: str, results: str, poll: float = 1.0):
+    """Runs queued jobs one after another until the process is terminated"""
+    connection = Connect(database)
+    while True:
+        job = Claim(connection)
+        if job is None:
+            time.sleep(poll)
+            continue
+
+        def Progress(lnf, iter, flatness):
+            connection.execute(
+                "UPDATE jobs SET lnf = ?, iter = ?, flatness = ? WHERE id = ?",
+                (lnf, iter, flatness, job["id"]),
+            )
+
+        directory = os.path.join(results, job["key"][:16])
+        path = os.path.join(directory, "out_final.txt")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            REF, LNGE_A, HIST_A, META = RunConfiguration(
+                job["config"], seed=job["seed"], QUIET=True, PROGRESS=Progress
+            )
+            data_dict = {"E": REF, "lng(E)": LNGE_A, "H(E)": HIST_A}
+            pd.DataFrame.from_dict(data_dict).to_csv(path)
+            SaveMeta(path, {**META, "seed": job["seed"]})
+            # Unconverged results are kept for inspection but never served from the cache
+            status = "done" if META["converged"] else "unconverged"
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ?",
+                (status, path, time.time(), job["id"]),
+            )
+        except Exception as error:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                (repr(error), time.time(), job["id"]),
+            )
+
+
+def MakeHandler(database: str):
+    class Handler(BaseHTTPRequestHandler):
+        """GET /jobs, GET /jobs/<id>, POST /jobs with {"config": {...}, "seed": 1}"""
+
+        def Reply(self, code: int, body):
+            data = json.dumps(body, indent=2).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["jobs"]:
+                return self.Reply(200, Status(database))
+            if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+                job = Status(database, int(parts[1]))
+                if job is None:
+                    return self.Reply(404, {"error": "unknown job"})
+                return self.Reply(200, job)
+            self.Reply(404, {"error": "unknown path"})
+
+        def do_POST(self):
+            if self.path.strip("/") != "jobs":
+                return self.Reply(404, {"error": "unknown path"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("The request must be a JSON object")
+                job = Submit(database, request.get("config", {}), request.get("seed"))
+            except (ValueError, TypeError) as error:
+                return self.Reply(400, {"error": str(error)})
+            self.Reply(200, job)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def Serve(database: str, results: str, workers: int, port: int):
+    """Starts the worker pool and the HTTP interface on localhost"""
+    connection = Connect(database)
+    # Jobs that were running when the server stopped are queued again
+    connection.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+    connection.close()
+
+    pool = [
+        multiprocessing.Process(target=Worker, args=(database, results), daemon=True)
+        for w in range(workers)
+    ]
+    for process in pool:
+        process.start()
+    print(f"{workers} workers, listening on http://127.0.0.1:{port}/jobs")
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MakeHandler(database))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for process in pool:
+            process.terminate()
+
+
+def ParseValue(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WLA job server")
+    parser.add_argument(
+        "-b", "--database", type=str, help="job database", default="jobs.sqlite"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the workers and the HTTP interface")
+    serve.add_argument("-w", "--workers", type=int, help="concurrent runs", default=1)
+    serve.add_argument("-p", "--port", type=int, help="HTTP port", default=8765)
+    serve.add_argument(
+        "-r", "--results", type=str, help="result directory", default="WLA-JOBS"
+    )
+
+    submit = commands.add_parser("submit", help="queue a run")
+    submit.add_argument("options", nargs="*", help="key=value, keys as in main.py")
+    submit.add_argument("-s", "--seed", type=int, help="random seed", default=None)
+
+    status = commands.add_parser("status", help="show one job")
+    status.add_argument("job", type=int)
+
+    commands.add_parser("list", help="show all jobs")
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        Serve(args.database, args.results, args.workers, args.port)
+    elif args.command == "submit":
+        config = {}
+        for option in args.options:
+            key, value = option.split("=", 1)
+            config[key] = ParseValue(value)
+        print(json.dumps(Submit(args.database, config, args.seed), indent=2))
+    elif args.command == "status":
+        print(json.dumps(Status(args.database, args.job), indent=2))
+    else:
+        for job in Status(args.database):
+            print(
+                f"{job['id']:5d}  {job['status']:11s}  lnf={job['lnf']}  "
+                f"flatness={job['flatness']}  {job['result'] or ''}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ v2.0.1  object orienetd approach
 import argparse
 import os
 from functions import *
+from functions_profile import Profiler
+from functions_run import DEFAULTS, RunConfiguration, SaveMeta
 
 
 def main():
@@ -23,54 +25,93 @@ def main():
     parser.add_argument(
         "-m", "--finallnf", type=float, help="final lnf(f)", default=0.000001
     )
+    parser.add_argument(
+        "--maxsteps",
+        type=float,
+        help="maximum number of steps of every ln(f) stage",
+        default=1e6,
+    )
     parser.add_argument("-n", "--bins", type=int, help="number of bins", default=100)
     parser.add_argument(
         "-q", "--qstates", type=int, help="number of q states", default=2
     )
+    parser.add_argument(
+        "-l",
+        "--geometry",
+        type=str,
+        help="lattice geometry",
+        choices=["square", "triangular", "honeycomb", "cubic"],
+        default="square",
+    )
+    parser.add_argument(
+        "-d", "--dilution", type=float, help="fraction of empty sites", default=0.0
+    )
+    parser.add_argument(
+        "--dense",
+        action="store_true",
+        help="use the generic lattice instead of the bit-packed one for Q=2",
+    )
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="Q=2 on bipartite lattices: sample only the lower half of the energy range",
+    )
+    parser.add_argument(
+        "--refine",
+        action="store_true",
+        help="check the flatness on coarse histogram bins first, refined to one bin per energy level",
+    )
+    parser.add_argument(
+        "--coarsebins",
+        type=int,
+        help="maximum number of histogram bins of the first refinement level",
+        default=32,
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, help="random seed (default: random)", default=None
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="stream lng(E) snapshots to a memory-mapped history file",
+    )
+    parser.add_argument(
+        "--snapshots",
+        type=int,
+        help="extra snapshot every n printing intervals",
+        default=0,
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="stop once successive ln(f) stages agree within tolerance",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time the phases of the run, writes profile.txt and profile.folded",
+    )
 
     args = parser.parse_args()
 
     DIRECTORY_NAME = args.directoryname
-    L = args.gridsize
-    N = args.bins
-    FLATNESS = args.flatness
-    Q = args.qstates
-    FINAL_LNF = args.finallnf
 
     try:
         os.mkdir(DIRECTORY_NAME)
     except FileExistsError:
         pass
 
-    maxsteps = 1e6
-    LB = -2.0 * L**2
-    UB = -0.0 * L**2
-
-    ref = np.linspace(LB, UB, N)  # Setting up energy bins
-    print("Number of Bins:", N)
-
-    EnergyCheck = False
-    while not EnergyCheck:
-        x = Lattice(L)
-        x.Randomize()
-        initial_energy = x.GridEnergy(1)
-        if initial_energy <= UB and initial_energy >= LB:
-            EnergyCheck = True
-
-    print("Found initial lattice. Energy: ", initial_energy)
+    profile = Profiler() if args.profile else None
+    config = {key: value for key, value in vars(args).items() if key in DEFAULTS}
 
-    (REF, LNGE_A, HIST_A) = WangLandau(
-        x,
-        ref,
-        maxsteps,
-        NBINS=N,
-        INTERVAL=100,
-        L=L,
-        FLATNESS=FLATNESS,
-        CONTROLF=FINAL_LNF,
-        q=Q,
-        LB=LB,
-        UB=UB,
+    REF, LNGE_A, HIST_A, META = RunConfiguration(
+        config,
+        seed=args.seed,
+        HISTORY_PATH=f"{DIRECTORY_NAME}/history.npy" if args.history else None,
+        SNAPSHOTS=args.snapshots,
+        TOLERANCE=args.tolerance,
+        PROFILE=profile,
     )
 
     #######################################################
@@ -78,7 +119,13 @@ def main():
     data_dict = {"E": REF, "lng(E)": LNGE_A, "H(E)": HIST_A}
     data = pd.DataFrame.from_dict(data_dict)
     data.to_csv(f"{DIRECTORY_NAME}/out_final.txt")
+    SaveMeta(f"{DIRECTORY_NAME}/out_final.txt", META)
     print("Saved results.")
+    if not META["converged"]:
+        print("WARNING: no convergence, the results stop at ln(f) =", META["lnf"])
+    if profile is not None:
+        print(profile.Report())
+        profile.Save(DIRECTORY_NAME)
     #######################################################
 
 
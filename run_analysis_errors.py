@@ -0,0 +1,34 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from functions_errors import *
+
+if __name__ == "__main__":
+    # Independent replicas of a 16x16 Ising run, C(T) with jackknife error bars
+    config = {
+        "gridsize": 16,
+        "qstates": 2,
+        "bins": 100,
+        "finallnf": 1e-6,
+        "maxsteps": 1e8,
+    }
+    temps = np.linspace(0.5, 2.5, 200)
+
+    energies, dos, thermo, R = ReplicaErrors(config, temps, TARGET=0.02)
+    (F, U, C, S), (dF, dU, dC, dS) = thermo
+
+    plt.errorbar(
+        temps,
+        C,
+        yerr=dC,
+        fmt="o--",
+        color="blue",
+        alpha=0.4,
+        markersize=4,
+        label=f"16x16, {R} replicas",
+    )
+    tc = 1.0 / np.log(1 + np.sqrt(2))  # Potts convention (E = -sum delta)
+    plt.axvline(tc, color="k")
+    plt.xlabel("T")
+    plt.ylabel("C(T)/N")
+    plt.legend(loc="best")
+    plt.savefig("C-versus-T-errors.png")
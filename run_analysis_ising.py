@@ -4,10 +4,11 @@ import matplotlib.pyplot as plt
 from functions_analysis import *
 
 if __name__ == "__main__":
-    data_16x16 = pd.read_csv("examples/16x16GRID/out_final.txt")
-    data_10x10 = pd.read_csv("examples/10x10GRID/out_final.txt")
-    data_24x24 = pd.read_csv("examples/24x24GRID/out_final.txt")
-    data_32x32 = pd.read_csv("examples/32x32GRID/out_final.txt")
+    # Results with metadata (out_final.json) are loaded in the same way
+    data_16x16 = "examples/16x16GRID/out_final.txt"
+    data_10x10 = "examples/10x10GRID/out_final.txt"
+    data_24x24 = "examples/24x24GRID/out_final.txt"
+    data_32x32 = "examples/32x32GRID/out_final.txt"
 
     data = [data_10x10, data_16x16, data_24x24, data_32x32]
     gridsizes = [10, 16, 24, 32]
@@ -15,7 +16,7 @@ if __name__ == "__main__":
     colors = ["orange", "blue", "green", "red"]
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = MirrorDataAndNormalize(d)
+        x, y, meta = LoadResult(d, 2)
         plt.plot(
             x * N,
             y,
@@ -34,11 +35,8 @@ if __name__ == "__main__":
     temps = np.linspace(0.5, 5.0, 500)  # T varies from 0.4 to 8
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = MirrorDataAndNormalize(d)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 2)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
@@ -60,11 +58,8 @@ if __name__ == "__main__":
     temps = np.linspace(0.5, 5.0, 500)  # T varies from 0.4 to 8
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = MirrorDataAndNormalize(d)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 2)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
@@ -82,11 +77,8 @@ if __name__ == "__main__":
     plt.clf()
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = MirrorDataAndNormalize(d)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 2)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
@@ -106,11 +98,8 @@ if __name__ == "__main__":
     plt.clf()
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = MirrorDataAndNormalize(d)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 2)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
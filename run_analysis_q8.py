@@ -4,8 +4,9 @@ import matplotlib.pyplot as plt
 from functions_analysis import *
 
 if __name__ == "__main__":
-    data10 = pd.read_csv("examples/10x10_Q8/out_final.txt")
-    data16 = pd.read_csv("examples/16x16_Q8/out_final.txt")
+    # Results with metadata (out_final.json) are loaded in the same way
+    data10 = "examples/10x10_Q8/out_final.txt"
+    data16 = "examples/16x16_Q8/out_final.txt"
 
     data = [data10, data16]
     colors = ["orange", "blue"]
@@ -15,7 +16,7 @@ if __name__ == "__main__":
     tc = 1.0 / (np.log(1 + np.sqrt(8)))
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = Normalize(d, 8, N)
+        x, y, meta = LoadResult(d, 8)
         plt.plot(
             x * N,
             y,
@@ -35,11 +36,8 @@ if __name__ == "__main__":
     temps = np.linspace(0.1, 2.0, 500)  # T varies from 0.4 to 8
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = Normalize(d, 8, N)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 8)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
@@ -58,11 +56,8 @@ if __name__ == "__main__":
     plt.clf()
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = Normalize(d, 8, N)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 8)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
@@ -81,11 +76,8 @@ if __name__ == "__main__":
     plt.clf()
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = Normalize(d, 8, N)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 8)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
@@ -104,11 +96,8 @@ if __name__ == "__main__":
     plt.clf()
 
     for color, N, g, d in zip(colors, latticesize, gridsizes, data):
-        x, y = Normalize(d, 8, N)
-        plots = []
-        for T in temps:
-            plots.append(MLOThermo(T, x, y, N))
-        plots = np.array(plots)
+        x, y, meta = LoadResult(d, 8)
+        plots = np.array(MLOThermo(temps, x, y, N)).T  # All temperatures at once
         fig = plt.figure(1)
         plt.plot(
             temps,
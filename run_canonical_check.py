@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd  # type: ignore
+from functions import Lattice
+from functions_analysis import *
+from functions_canonical import *
+
+if __name__ == "__main__":
+    # The example data use the Ising convention E = -sum s_i s_j (s = -1, +1), the lattice
+    # uses the Potts convention E = -sum delta(s_i, s_j). With E_ising = 2 E_potts + 2 N
+    # the Ising model at T corresponds to the Potts model at T / 2 (C(T) is the same).
+    g = 16
+    N = g**2
+    x, y, meta = LoadResult("examples/16x16GRID/out_final.txt", 2)
+
+    tc = 2 * 1 / np.log(np.sqrt(2) + 1)
+    temps = [1.5, 2.0, tc, 2.5, 3.0]
+
+    lattice = Lattice(g)
+    lattice.Randomize(2)
+    print("    T   U(WL)    U(MC)            C(WL)    C(MC)")
+    for T in temps:
+        F, U, C, S = MLOThermo(T, x, y, N)
+        E, M = Canonical(lattice, T / 2, q=2, SWEEPS=20000, METHOD="heatbath")
+        U_mc, C_mc, dU, dC = CanonicalThermo(2 * E + 2 * N, T, N)
+        print(
+            f"{T:5.3f}  {U:7.4f}  {U_mc:7.4f}({dU:.4f})  {C:7.4f}  {C_mc:7.4f}({dC:.4f})"
+            f"  tau_E={IntegratedAutocorrelation(E):.1f}"
+        )
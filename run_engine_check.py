@@ -0,0 +1,79 @@
+import sys
+import numpy as np
+from functions import DeltaEnergy, Lattice, Seed
+from functions_ising import PackedDeltaEnergy, PackedIsingLattice
+from functions_run import RunConfiguration
+
+
+def ExactLnge(lattice: Lattice, q: int):
+    """Exact lng(E) by enumerating all q**N configurations (small lattices only)"""
+    n = len(lattice.sites)
+    states = (np.arange(q**n)[:, None] // q ** np.arange(n)) % q
+    source = np.repeat(np.arange(n), np.diff(lattice.offsets))
+    bonds = source < lattice.neighbors  # Every bond once
+    i, j = source[bonds], lattice.neighbors[bonds]
+    energies = -np.sum(
+        lattice.couplings[bonds] * (states[:, i] == states[:, j]), axis=1
+    )
+    E, counts = np.unique(energies, return_counts=True)
+    return (E, np.log(counts))
+
+
+def CompareWithExact(config: dict, seeds: int = 4) -> float:
+    """Largest deviation of the seed-averaged WLA lng(E) from the exact one, both normalized to sum q**N"""
+    q = config["qstates"]
+    E, exact = ExactLnge(Lattice(config["gridsize"]), q)
+    runs = []
+    for seed in range(1, seeds + 1):
+        REF, LNGE, HIST, META = RunConfiguration(config, seed=seed, QUIET=True)
+        energies = np.round(REF * META["particles"])
+        if not META["converged"] or not np.array_equal(energies, E):
+            return np.inf
+        norm = META["particles"] * np.log(q)
+        runs.append(LNGE - np.logaddexp.reduce(LNGE) + norm)
+    return np.max(np.abs(np.mean(runs, axis=0) - exact))
+
+
+if __name__ == "__main__":
+    # python run_engine_check.py: checks the packed Ising lattice against the CSR lattice and
+    # the WLA against the exact density of states of small lattices
+    failed = False
+    Seed(1)
+    for size in [4, 15, 16, 64, 70]:
+        packed = PackedIsingLattice(size)
+        packed.Randomize(2)
+        dense = Lattice(size)
+        dense.spins = packed.grid.ravel()
+        same = packed.GridEnergy(1.0) == dense.GridEnergy(1.0)
+        for step in range(1000):
+            i, j = np.random.randint(0, size, 2)
+            n = i * size + j
+            delta = DeltaEnergy(
+                dense.spins,
+                dense.offsets,
+                dense.neighbors,
+                dense.couplings,
+                n,
+                1.0 - dense.spins[n],
+            )
+            same = same and delta == PackedDeltaEnergy(packed.words, size, i, j, 1.0)
+        print(
+            f"packed vs CSR, {size}x{size}: energy and dE {'ok' if same else 'FAILED'}"
+        )
+        failed = failed or not same
+
+    runs = [
+        ("4x4 Q=2, packed", {"gridsize": 4, "qstates": 2}),
+        ("4x4 Q=2, CSR", {"gridsize": 4, "qstates": 2, "dense": True}),
+        ("3x3 Q=3, CSR", {"gridsize": 3, "qstates": 3}),
+    ]
+    # The WLA error of a single run saturates (0.1 to 0.4 here with flatness 0.95), so the
+    # comparison uses the mean over a few seeds
+    for name, config in runs:
+        config = {**config, "finallnf": 1e-6, "flatness": 0.95, "maxsteps": 1e8}
+        config["refine"] = True  # One bin per energy level
+        deviation = CompareWithExact(config)
+        print(f"exact DOS, {name}: max |dlng(E)| = {deviation:.4f}")
+        failed = failed or not deviation < 0.25
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,32 @@
+import sys
+import time
+import numpy as np
+from functions_history import *
+
+if __name__ == "__main__":
+    # python run_watch_history.py WLA-RUN/history.npy [tolerance]
+    path = sys.argv[1]
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+
+    seen = 0
+    while True:
+        finished = HistoryFinished(
+            path
+        )  # Checked first, the last records are read below
+        ref, records = ReadHistory(path)
+        stages = records[records["kind"] == STAGE_SNAPSHOT]
+        for n in range(max(seen, 1), len(stages)):
+            difference = SnapshotDifference(stages[n - 1], stages[n])
+            print(
+                f"ln(f)={stages[n]['lnf']:.3e}  steps={stages[n]['iter']}  "
+                f"change of lng(E)={difference:.6f}"
+            )
+        seen = max(seen, len(stages))
+        if tolerance > 0 and HistoryConverged(path, tolerance):
+            print("Converged, asking the run to stop.")
+            RequestStop(path)
+            break
+        if finished:
+            print("The run has ended.")
+            break
+        time.sleep(5)